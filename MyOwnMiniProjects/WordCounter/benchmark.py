@@ -0,0 +1,242 @@
+"""Benchmarks for WordCounter.
+
+Builds synthetic corpora out of testText.txt and testText2.txt and times
+every counting mode on them. Each measurement runs in its own process so
+the peak RSS it reports belongs to that mode alone.
+
+    python benchmark.py --sizes 1MB 64MB 2GB --variants ascii unicode longline
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from wordCounter import WordCounter
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak RSS is reported as null there
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEED_FILES = [os.path.join(HERE, "testText.txt"), os.path.join(HERE, "testText2.txt")]
+
+SIZE_UNITS = {"KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+# extra words and separators mixed in by the unicode variant
+UNICODE_WORDS = ["naïve", "Straße", "日本語", "Ελληνικά", "кириллица", "😀", "ﬁle", "عربى"]
+UNICODE_SEPARATORS = [" ", " ", " ", "\u00a0", "\u3000", "\u2003", "\n"]
+
+# blocks of text the corpora are stitched together from
+BLOCK_SIZE = 1024 * 1024
+BLOCK_COUNT = 8
+
+VARIANTS = ["ascii", "unicode", "longline"]
+
+
+def legacyCount(filePath):
+    # the original readlines path, kept as the baseline to beat
+    with open(filePath, "r", encoding="utf-8") as file:
+        allText = "".join(file.readlines())
+        return len(allText.split())
+
+
+def countParallel(filePath):
+    return WordCounter(encoding="utf-8").countWordsParallel(filePath)
+
+
+MODES = {
+    "readlines": legacyCount,
+    "stream": lambda filePath: WordCounter(encoding="utf-8").countWords(filePath),
+    "mmap": lambda filePath: WordCounter(encoding="utf-8").countWordsMapped(filePath),
+    "parallel": countParallel,
+    "exact-frequency": lambda filePath: WordCounter(encoding="utf-8")
+    .wordFrequencies(filePath)
+    .total,
+    "approx-frequency": lambda filePath: WordCounter(encoding="utf-8")
+    .wordFrequencies(filePath, approximate=True)
+    .total,
+    "wc": lambda filePath: WordCounter(encoding="utf-8").countAll(filePath).words,
+}
+
+
+def parseSize(text):
+    text = text.strip().upper()
+    for unit, factor in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[: -len(unit)]) * factor)
+    return int(text)
+
+
+def formatSize(size):
+    for unit, factor in reversed(SIZE_UNITS.items()):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return f"{size}B"
+
+
+def seedWords():
+    words = []
+    for seedFile in SEED_FILES:
+        with open(seedFile, "r", encoding="utf-8") as file:
+            words.extend(file.read().split())
+    return words
+
+
+def makeBlock(variant, words, generator):
+    pieces = []
+    size = 0
+
+    while size < BLOCK_SIZE:
+        if variant == "ascii":
+            word = words[generator.randrange(len(words))].encode("ascii", "ignore").decode()
+            separator = "\n" if generator.random() < 0.08 else " "
+        elif variant == "unicode":
+            if generator.random() < 0.3:
+                word = generator.choice(UNICODE_WORDS)
+            else:
+                word = words[generator.randrange(len(words))]
+            separator = generator.choice(UNICODE_SEPARATORS)
+        else:
+            # one endless line, words cross every chunk boundary
+            word = words[generator.randrange(len(words))]
+            separator = " "
+
+        piece = word + separator
+        pieces.append(piece)
+        size += len(piece.encode("utf-8"))
+
+    return "".join(pieces).encode("utf-8")
+
+
+def buildCorpus(directory, variant, size, seed=0):
+    """Write a corpus file of exactly `size` bytes, reusing it when it already exists."""
+    filePath = os.path.join(directory, f"{variant}-{formatSize(size)}.txt")
+    if os.path.exists(filePath) and os.path.getsize(filePath) == size:
+        return filePath
+
+    generator = random.Random(seed)
+    words = seedWords()
+    blocks = [makeBlock(variant, words, generator) for _ in range(BLOCK_COUNT)]
+
+    os.makedirs(directory, exist_ok=True)
+    with open(filePath, "wb") as file:
+        remaining = size
+        while remaining > 0:
+            block = generator.choice(blocks)[:remaining]
+            if len(block) == remaining:
+                # don't leave half a utf-8 character at the very end
+                block = block[: len(block.decode("utf-8", "ignore").encode("utf-8"))]
+                block += b" " * (remaining - len(block))
+            file.write(block)
+            remaining -= len(block)
+
+    return filePath
+
+
+def peakRss():
+    """Peak resident memory of this process and its children, in bytes."""
+    if resource is None:
+        return None
+
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def runOne(mode, filePath):
+    start = time.perf_counter()
+    words = MODES[mode](filePath)
+    seconds = time.perf_counter() - start
+    return {"words": words, "seconds": seconds, "peakRss": peakRss()}
+
+
+def measure(mode, filePath, repeats):
+    """Run a mode in fresh processes and keep the fastest of the runs."""
+    best = None
+
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-one", mode, filePath],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the WordCounter counting modes.")
+    parser.add_argument("--sizes", nargs="+", default=["1MB", "16MB", "128MB"])
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--repeats", type=int, default=3, help="runs per mode, the best is kept")
+    parser.add_argument(
+        "--corpus-dir",
+        default=os.path.join(HERE, "benchmarkCorpora"),
+        help="where the generated corpora are kept between runs",
+    )
+    parser.add_argument("--json", action="store_true", help="print json lines instead of a table")
+    parser.add_argument("--run-one", nargs=2, metavar=("MODE", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        print(json.dumps(runOne(*args.run_one)))
+        return 0
+
+    mismatches = 0
+
+    if not args.json:
+        print(f"{'corpus':<18}{'mode':<18}{'words':>12}{'MB/s':>10}{'peak RSS MB':>14}")
+
+    for variant in args.variants:
+        for size in map(parseSize, args.sizes):
+            filePath = buildCorpus(args.corpus_dir, variant, size)
+            expected = None
+
+            for mode in args.modes:
+                result = measure(mode, filePath, args.repeats)
+                megabytes = size / SIZE_UNITS["MB"]
+                row = {
+                    "corpus": os.path.basename(filePath),
+                    "mode": mode,
+                    "words": result["words"],
+                    "mbPerSecond": megabytes / result["seconds"] if result["seconds"] else None,
+                    "peakRssMb": result["peakRss"] / SIZE_UNITS["MB"]
+                    if result["peakRss"] is not None
+                    else None,
+                }
+
+                if expected is None:
+                    expected = result["words"]
+                elif result["words"] != expected:
+                    mismatches += 1
+                    row["mismatch"] = expected
+
+                if args.json:
+                    print(json.dumps(row))
+                else:
+                    rss = "-" if row["peakRssMb"] is None else f"{row['peakRssMb']:.1f}"
+                    flag = "  MISMATCH" if "mismatch" in row else ""
+                    print(
+                        f"{row['corpus']:<18}{mode:<18}{row['words']:>12}"
+                        f"{row['mbPerSecond']:>10.1f}{rss:>14}{flag}"
+                    )
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""On-disk cache of WordCounter results.
+
+Entries are keyed by the kind of result (which also names the encoding
+the file was read with) and the absolute path, and checked against the
+file's size and modification time. With useHash=True a file whose mtime changed
+but whose size did not gets its content hashed before it is recounted,
+so files that were only touched are still answered from the cache.
+The least recently used entries are dropped once maxEntries is reached.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hashFile(filePath):
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(filePath, "rb") as file:
+        while True:
+            block = file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class CountCache:
+    def __init__(self, cachePath, maxEntries=100_000, useHash=False) -> None:
+        self.cachePath = cachePath
+        self.maxEntries = maxEntries
+        self.useHash = useHash
+
+        # oldest entries first, so eviction pops from the front
+        self.entries = OrderedDict()
+        self.changed = False
+        self.lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cachePath, "r", encoding="utf-8") as file:
+                self.entries = OrderedDict(json.load(file))
+        except (FileNotFoundError, ValueError):
+            self.entries = OrderedDict()
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+
+            # write next to the real file then swap, so a crash never leaves half a cache
+            temporaryPath = f"{self.cachePath}.tmp"
+            with open(temporaryPath, "w", encoding="utf-8") as file:
+                json.dump(list(self.entries.items()), file)
+            os.replace(temporaryPath, self.cachePath)
+            self.changed = False
+
+    def makeKey(self, filePath, kind):
+        return f"{kind}:{os.path.abspath(filePath)}"
+
+    def lookup(self, filePath, kind="words"):
+        """Return (value, fingerprint) for a file.
+        value is None when the file has to be counted again, the fingerprint
+        should then be handed back to store() together with the new value.
+        """
+        stat = os.stat(filePath)
+        fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        key = self.makeKey(filePath, kind)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None or entry["size"] != stat.st_size:
+            return None, fingerprint
+
+        if entry["mtime"] != stat.st_mtime_ns:
+            if not (self.useHash and entry.get("hash")):
+                return None, fingerprint
+
+            fingerprint["hash"] = hashFile(filePath)
+            if fingerprint["hash"] != entry["hash"]:
+                return None, fingerprint
+
+            # same content, only the timestamp moved
+            self.store(filePath, fingerprint, entry["value"], kind)
+            return entry["value"], fingerprint
+
+        # a run with only hits does not rewrite the file, the new order
+        # is saved with the next run that stores something
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+
+        return entry["value"], fingerprint
+
+    def store(self, filePath, fingerprint, value, kind="words"):
+        if self.useHash and "hash" not in fingerprint:
+            fingerprint = dict(fingerprint, hash=hashFile(filePath))
+
+        key = self.makeKey(filePath, kind)
+
+        with self.lock:
+            self.entries[key] = dict(fingerprint, value=value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+            self.changed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
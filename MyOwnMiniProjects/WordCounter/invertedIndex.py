@@ -0,0 +1,376 @@
+"""Inverted index built on the words WordCounter finds.
+
+Every term maps to the files it shows up in and the word positions inside
+each file, all in one byte buffer per term. For every file, in file id order,
+it holds the gap to the previous file id (shifted left, the low bit set when
+the term shows up only once in the file), the byte length of the file's
+positions unless there is only one, then the gaps between the positions.
+Every number is a varint (7 bits per byte, the high bit set on all bytes but
+the last), so small gaps take a single byte and a posting costs a few bytes
+instead of a Python object. The index file holds the buffers zlib compressed.
+
+Removed and changed files are only marked as removed, their postings are
+dropped in one pass over the buffers when the index is saved.
+Files whose size and mtime did not change are not indexed again.
+"""
+
+import argparse
+import os
+import pickle
+import string
+import sys
+import threading
+import zlib
+from array import array
+
+INDEX_VERSION = 2
+
+PUNCTUATION = string.punctuation + "“”‘’«»—–…"
+
+# what a truncated or garbled index file makes pickle.load raise
+CORRUPT_INDEX_ERRORS = (
+    EOFError,
+    pickle.UnpicklingError,
+    AttributeError,
+    ImportError,
+    IndexError,
+    KeyError,
+    TypeError,
+    ValueError,
+    zlib.error,
+)
+
+
+def normalizeTerm(word):
+    return word.strip(PUNCTUATION).casefold()
+
+
+def encodeVarints(values, buffer=None):
+    """Append the numbers to a bytearray (a new one by default) as varints."""
+    if buffer is None:
+        buffer = bytearray()
+
+    # most gaps are small, one byte each and no loop over the bits
+    if not values or max(values) < 0x80:
+        buffer += bytes(values)
+        return buffer
+
+    for value in values:
+        while value >= 0x80:
+            buffer.append(value & 0x7F | 0x80)
+            value >>= 7
+        buffer.append(value)
+    return buffer
+
+
+def readVarint(buffer, offset):
+    """Return (number, offset after it) for the varint at offset."""
+    value = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def decodeVarints(buffer, start=0, end=None):
+    end = len(buffer) if end is None else end
+    values = []
+    offset = start
+    while offset < end:
+        value, offset = readVarint(buffer, offset)
+        values.append(value)
+    return values
+
+
+def encodeGaps(values):
+    """Varints of the gaps between sorted numbers (the first one from 0)."""
+    return encodeVarints(
+        [value - previous for previous, value in zip([0] + values, values)]
+    )
+
+
+def decodeGaps(buffer, start=0, end=None):
+    values = []
+    value = 0
+    for gap in decodeVarints(buffer, start, end):
+        value += gap
+        values.append(value)
+    return values
+
+
+def appendPosting(buffer, fileGap, gaps, single):
+    """Append one file's record to a term's buffer, gaps are its encoded positions."""
+    if single:
+        encodeVarints([fileGap << 1 | 1], buffer)
+    else:
+        encodeVarints([fileGap << 1, len(gaps)], buffer)
+    buffer += gaps
+
+
+def iterPostings(buffer):
+    """Yield (fileId, start, end, single) for every file in a term's buffer,
+    buffer[start:end] holds the file's position gaps.
+    """
+    fileId = 0
+    offset = 0
+    while offset < len(buffer):
+        header, offset = readVarint(buffer, offset)
+        fileId += header >> 1
+        if header & 1:
+            start = offset
+            _, offset = readVarint(buffer, offset)
+            yield fileId, start, offset, True
+        else:
+            length, offset = readVarint(buffer, offset)
+            yield fileId, offset, offset + length, False
+            offset += length
+
+
+def dropPostings(buffer, fileIds):
+    """A copy of a term's buffer without the records of fileIds."""
+    kept = bytearray()
+    previousId = 0
+    for fileId, start, end, single in iterPostings(buffer):
+        if fileId in fileIds:
+            continue
+        appendPosting(kept, fileId - previousId, buffer[start:end], single)
+        previousId = fileId
+    return kept
+
+
+class InvertedIndex:
+    def __init__(self) -> None:
+        # fileId -> {"path", "size", "mtime", "words"}
+        self.files = {}
+        self.fileIds = {}
+        self.nextFileId = 0
+        # ids of removed files whose records are still in the buffers
+        self.removed = set()
+
+        # termId -> term and back, ids are never reused
+        self.terms = []
+        self.termIds = {}
+        # termId -> bytearray of the term's postings (see the module docstring)
+        self.postings = []
+        # termId -> id of the last file in its postings, filled in when needed
+        self.lastFileIds = {}
+
+        self.changed = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, indexPath):
+        """Read an index file, a missing, outdated or corrupt one gives an empty
+        index (its files are then indexed again).
+        """
+        try:
+            with open(indexPath, "rb") as file:
+                data = pickle.load(file)
+
+            index = cls()
+            if data.get("version") != INDEX_VERSION:
+                return index
+
+            terms = zlib.decompress(data["terms"]).decode("utf-8")
+            terms = terms.split("\n") if terms else []
+            lengths = decodeVarints(zlib.decompress(data["postingLengths"]))
+            blob = zlib.decompress(data["postings"])
+            if len(terms) != len(lengths) or sum(lengths) != len(blob):
+                raise ValueError("postings don't match the terms")
+
+            offset = 0
+            for length in lengths:
+                index.postings.append(bytearray(blob[offset : offset + length]))
+                offset += length
+
+            index.terms = [sys.intern(term) for term in terms]
+            index.termIds = {term: termId for termId, term in enumerate(index.terms)}
+            index.files = data["files"]
+            index.nextFileId = data["nextFileId"]
+            index.fileIds = {entry["path"]: fileId for fileId, entry in index.files.items()}
+        except FileNotFoundError:
+            return cls()
+        except CORRUPT_INDEX_ERRORS:
+            # truncated or garbled, counting goes on and rebuilds it
+            return cls()
+
+        return index
+
+    def save(self, indexPath):
+        with self.lock:
+            if not self.changed and os.path.exists(indexPath):
+                return
+
+            self.compactLocked()
+
+            # a handful of objects in the pickle however many postings there are
+            data = {
+                "version": INDEX_VERSION,
+                "files": self.files,
+                "terms": zlib.compress("\n".join(self.terms).encode("utf-8")),
+                "postingLengths": zlib.compress(
+                    encodeVarints([len(postings) for postings in self.postings])
+                ),
+                "postings": zlib.compress(b"".join(self.postings)),
+                "nextFileId": self.nextFileId,
+            }
+            temporaryPath = f"{indexPath}.tmp"
+            with open(temporaryPath, "wb") as file:
+                pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporaryPath, indexPath)
+            self.changed = False
+
+    def compactLocked(self):
+        """Drop the records of the removed files from the buffers."""
+        if not self.removed:
+            return
+
+        for termId, postings in enumerate(self.postings):
+            self.postings[termId] = dropPostings(postings, self.removed)
+        self.removed.clear()
+        self.lastFileIds.clear()
+
+    def isCurrent(self, filePath):
+        stat = os.stat(filePath)
+
+        with self.lock:
+            fileId = self.fileIds.get(os.path.abspath(filePath))
+            if fileId is None:
+                return False
+            entry = self.files[fileId]
+
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns
+
+    def termIdLocked(self, term):
+        termId = self.termIds.get(term)
+        if termId is None:
+            termId = self.termIds[term] = len(self.terms)
+            self.terms.append(term)
+            self.postings.append(bytearray())
+        return termId
+
+    def lastFileIdLocked(self, termId):
+        lastFileId = self.lastFileIds.get(termId)
+        if lastFileId is None:
+            lastFileId = 0
+            for lastFileId, _, _, _ in iterPostings(self.postings[termId]):
+                pass
+            self.lastFileIds[termId] = lastFileId
+        return lastFileId
+
+    def addFile(self, filePath, counter):
+        """(Re)index one file with the tokenizer of a WordCounter.
+        Returns the number of words in the file.
+        """
+        stat = os.stat(filePath)
+        termPositions = {}
+        wordCount = 0
+
+        for position, word in enumerate(counter.iterWords(filePath)):
+            wordCount += 1
+            term = normalizeTerm(word)
+            if term:
+                termPositions.setdefault(term, array("I")).append(position)
+
+        with self.lock:
+            self.removeLocked(os.path.abspath(filePath))
+
+            # new files get the highest id, so their records go at the end
+            fileId = self.nextFileId
+            self.nextFileId += 1
+
+            for term, positions in termPositions.items():
+                termId = self.termIdLocked(sys.intern(term))
+                appendPosting(
+                    self.postings[termId],
+                    fileId - self.lastFileIdLocked(termId),
+                    encodeGaps(positions.tolist()),
+                    len(positions) == 1,
+                )
+                self.lastFileIds[termId] = fileId
+
+            self.files[fileId] = {
+                "path": os.path.abspath(filePath),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "words": wordCount,
+            }
+            self.fileIds[os.path.abspath(filePath)] = fileId
+            self.changed = True
+
+        return wordCount
+
+    def update(self, filePaths, counter):
+        """Index new and changed files, skip the ones that are up to date."""
+        for filePath in filePaths:
+            if not self.isCurrent(filePath):
+                self.addFile(filePath, counter)
+
+    def removeFile(self, filePath):
+        with self.lock:
+            self.removeLocked(os.path.abspath(filePath))
+
+    def removeLocked(self, absolutePath):
+        fileId = self.fileIds.pop(absolutePath, None)
+        if fileId is None:
+            return
+
+        self.changed = True
+        del self.files[fileId]
+        self.removed.add(fileId)
+
+        # a long running process that never saves doesn't pile up dead records
+        if len(self.removed) > max(len(self.files), 1000):
+            self.compactLocked()
+
+    def prune(self):
+        """Forget files that no longer exist."""
+        for absolutePath in list(self.fileIds):
+            if not os.path.exists(absolutePath):
+                self.removeFile(absolutePath)
+
+    def postingsOf(self, term):
+        termId = self.termIds.get(normalizeTerm(term))
+        return self.postings[termId] if termId is not None else b""
+
+    def search(self, *terms, matchAll=True):
+        """Paths of the files that contain all (or any) of the terms."""
+        fileSets = [
+            {fileId for fileId, _, _, _ in iterPostings(self.postingsOf(term))}
+            for term in terms
+        ]
+        if not fileSets:
+            return []
+
+        fileIds = set.intersection(*fileSets) if matchAll else set.union(*fileSets)
+        return sorted(self.files[fileId]["path"] for fileId in fileIds - self.removed)
+
+    def positions(self, term, filePath):
+        fileId = self.fileIds.get(os.path.abspath(filePath))
+        buffer = self.postingsOf(term)
+        for postingId, start, end, _ in iterPostings(buffer):
+            if postingId == fileId:
+                return decodeGaps(buffer, start, end)
+        return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up terms in a WordCounter index.")
+    parser.add_argument("index", help="index file written by wordCounter.py --index")
+    parser.add_argument("terms", nargs="+")
+    parser.add_argument(
+        "--any", action="store_true", help="files with any of the terms instead of all"
+    )
+    args = parser.parse_args(argv)
+
+    index = InvertedIndex.load(args.index)
+    for path in index.search(*args.terms, matchAll=not args.any):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
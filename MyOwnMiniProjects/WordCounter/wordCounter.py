@@ -1,15 +1,610 @@
+import argparse
+import bz2
+import codecs
+import glob
+import gzip
+import io
+import json
+import locale
+import lzma
+import mmap
+import os
+import re
+import sys
+import unicodedata
+import zlib
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from countCache import CountCache
+from invertedIndex import InvertedIndex
+from wordFrequency import ApproxFrequency, ExactFrequency
+
+# read files in fixed-size pieces so memory stays flat no matter the file size
+CHUNK_SIZE = 1024 * 1024
+
+# files smaller than this are not worth the cost of starting worker processes
+MIN_SHARD_SIZE = 8 * 1024 * 1024
+
+# ascii whitespace never shows up inside a multi-byte utf-8 character,
+# so it is always safe to cut the raw bytes there
+SHARD_SEPARATORS = [b" ", b"\t", b"\n", b"\r", b"\x0b", b"\x0c"]
+
+# single bytes that str.split() treats as whitespace
+ASCII_WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+# the remaining unicode whitespace characters (all of them are below U+3001), utf-8 encoded
+UNICODE_WHITESPACE = [
+    character.encode("utf-8")
+    for character in map(chr, range(0x80, 0x3001))
+    if character.isspace()
+]
+
+# their first bytes: a window holding none of these has no unicode whitespace at all
+UNICODE_WHITESPACE_LEADS = sorted({whitespace[:1] for whitespace in UNICODE_WHITESPACE})
+
+
+def compileAlternatives(sequences):
+    """One regex matching any of the byte strings,
+    the ones that differ only in their last byte share a character class.
+    """
+    endings = {}
+    for sequence in sequences:
+        endings.setdefault(sequence[:-1], []).append(sequence[-1:])
+
+    return re.compile(
+        b"|".join(
+            re.escape(prefix) + b"[" + b"".join(map(re.escape, lasts)) + b"]"
+            for prefix, lasts in endings.items()
+        )
+    )
+
+
+# all of them in one pattern, so a window is searched once instead of once per character
+UNICODE_WHITESPACE_PATTERN = compileAlternatives(UNICODE_WHITESPACE)
+
+# turns every whitespace byte into b" " and everything else into b"x",
+# so each word start becomes a b" x" pair that bytes.count can find
+WORD_TABLE = bytes(32 if byte in ASCII_WHITESPACE else 120 for byte in range(256))
+
+# compressed files are recognised by their first bytes, not by their extension
+COMPRESSED_FORMATS = [
+    (b"\x1f\x8b", gzip.GzipFile),
+    (b"BZh", bz2.BZ2File),
+    (b"\xfd7zXZ\x00", lzma.LZMAFile),
+]
+MAGIC_SIZE = max(len(magic) for magic, _ in COMPRESSED_FORMATS)
+
+# what the decompressors raise on a corrupt or cut off body, besides OSError
+DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, EOFError)
+STREAM_READS = ("read", "read1", "readinto", "readinto1", "readline", "peek")
+
+# what `wc -lwmcL` reports, in one record
+FileStats = namedtuple("FileStats", "lines words chars bytes maxLineLength")
+
+# like wc -L: tabs jump to the next multiple of 8, \r and \f start the line over
+TAB_SIZE = 8
+LINE_RESETS = str.maketrans("\r\f", "\n\n")
+
+# control, format (zero width space, ...), combining and unassigned characters
+# and the line and paragraph separators take no column; the soft hyphen is a
+# format character that still takes one, like in wc
+ZERO_WIDTH_CATEGORIES = {"Cc", "Cf", "Mn", "Me", "Zl", "Zp", "Cn"}
+SOFT_HYPHEN = "\xad"
+
+# the characters GNU wc splits words on: ascii whitespace, the unicode spaces
+# and (since coreutils 9) the no-break spaces and the word joiner
+WC_SPACES = " \t\n\v\f\r\u2060" + "".join(
+    character
+    for character in map(chr, range(0x80, 0x3001))
+    if unicodedata.category(character) == "Zs"
+)
+
+# characters wc doesn't print: they neither start nor end a word
+WC_UNPRINTABLE_CATEGORIES = {"Cc", "Zl", "Zp", "Cn"}
+
+
+class WcWordTable(dict):
+    """str.translate table after which str.split() finds the words GNU wc finds:
+    wc's separators become spaces, and unprintable characters (which str.split()
+    partly takes for whitespace) are dropped. Filled in as characters show up.
+    """
+
+    def __missing__(self, codePoint):
+        character = chr(codePoint)
+        if character in WC_SPACES:
+            value = ord(" ")
+        elif unicodedata.category(character) in WC_UNPRINTABLE_CATEGORIES:
+            value = None
+        else:
+            value = codePoint
+        self[codePoint] = value
+        return value
+
+
+WC_WORD_TABLE = WcWordTable()
+
+# counting modes that can be picked from the command line
+COUNT_MODES = {"stream": "countWords", "mmap": "countWordsMapped"}
+
+
+def findDecompressor(head):
+    for magic, decompressor in COMPRESSED_FORMATS:
+        if head.startswith(magic):
+            return decompressor
+    return None
+
+
+def raisingOSError(read, filePath):
+    def wrapper(*args):
+        try:
+            return read(*args)
+        except DECOMPRESSION_ERRORS as error:
+            raise OSError(f"{filePath}: corrupt compressed data ({error})") from error
+
+    return wrapper
+
+
+def openBinary(filePath):
+    """Open a file for reading bytes, decompressing gzip, bz2 and xz on the fly.
+    The magic bytes are peeked, not read, so this works on pipes too.
+    Corrupt compressed data is reported as OSError, like any other unreadable file.
+    """
+    file = open(filePath, "rb")
+    decompressor = findDecompressor(file.peek(MAGIC_SIZE)[:MAGIC_SIZE])
+
+    if decompressor is None:
+        return file
+
+    stream = decompressor(fileobj=file) if decompressor is gzip.GzipFile else decompressor(file)
+
+    # the decompressors leave a file object they were handed open, so close it with them
+    closeStream = stream.close
+
+    def close():
+        try:
+            closeStream()
+        finally:
+            file.close()
+
+    stream.close = close
+
+    for name in STREAM_READS:
+        if hasattr(stream, name):
+            setattr(stream, name, raisingOSError(getattr(stream, name), filePath))
+    return stream
+
+
+def isAsciiCompatible(encoding):
+    """True when ascii characters encode to their own single bytes and the codec
+    keeps no shift state, so a file can be cut at any ascii whitespace byte
+    (utf-8, latin-1, cp1252, shift_jis... but not utf-16, utf-7 or iso2022).
+    """
+    name = codecs.lookup(encoding).name
+    if name.startswith("iso2022") or name == "hz":
+        return False
+    asciiBytes = bytes(range(128))
+    try:
+        return asciiBytes.decode("ascii").encode(name) == asciiBytes
+    except (UnicodeError, LookupError):
+        return False
+
+
+def isCompressed(filePath):
+    with open(filePath, "rb") as file:
+        return findDecompressor(file.read(MAGIC_SIZE)) is not None
+
+
+def displayWidth(text):
+    # printable characters below U+0300 are never wide or combining
+    # (control and format characters are not printable)
+    if text.isprintable() and (text.isascii() or max(text) < "\u0300"):
+        return len(text)
+
+    width = 0
+    for character in text:
+        if (
+            unicodedata.category(character) in ZERO_WIDTH_CATEGORIES
+            and character != SOFT_HYPHEN
+        ):
+            continue
+        width += 2 if unicodedata.east_asian_width(character) in "WF" else 1
+    return width
+
+
+def advanceColumn(column, segment):
+    """Column reached after printing a segment (no line breaks inside) from `column`."""
+    if "\t" not in segment:
+        return column + displayWidth(segment)
+
+    pieces = segment.split("\t")
+    for piece in pieces[:-1]:
+        column += displayWidth(piece)
+        column = (column // TAB_SIZE + 1) * TAB_SIZE
+    return column + displayWidth(pieces[-1])
+
+
+def findSeparator(block):
+    hits = [block.find(separator) for separator in SHARD_SEPARATORS]
+    hits = [hit for hit in hits if hit != -1]
+    return min(hits) if hits else -1
+
+
+def findShardBoundaries(filePath, shardCount, chunkSize=CHUNK_SIZE):
+    """Split a file into byte ranges that all start right after a whitespace byte,
+    so no word can belong to two shards.
+    """
+    fileSize = os.path.getsize(filePath)
+    boundaries = [0]
+
+    with open(filePath, "rb") as file:
+        for shardIndex in range(1, shardCount):
+            position = max(fileSize * shardIndex // shardCount, boundaries[-1])
+            file.seek(position)
+
+            while position < fileSize:
+                block = file.read(chunkSize)
+                cut = findSeparator(block)
+                if cut != -1:
+                    position += cut + 1
+                    break
+                position += len(block)
+
+            if position >= fileSize:
+                break
+            boundaries.append(position)
+
+    boundaries.append(fileSize)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def walkFiles(directory):
+    """Yield the paths of the files under directory. A folder that can't be listed
+    (no permission, removed meanwhile...) comes out as the OSError it raised,
+    and the walk goes on with the others.
+    """
+    folders = [directory]
+
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+        except OSError as error:
+            if error.filename is None:
+                error.filename = folder
+            yield error
+
+
+def expandPaths(patterns):
+    """Turn files, directories and glob patterns into a stream of file paths,
+    with an OSError for every directory that could not be listed (see walkFiles).
+    """
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            yield from walkFiles(pattern)
+        elif any(character in pattern for character in "*?["):
+            for match in glob.iglob(pattern, recursive=True):
+                if os.path.isdir(match):
+                    yield from walkFiles(match)
+                else:
+                    yield match
+        else:
+            # missing files are passed on so they get reported as errors
+            yield pattern
+
+
+def countShard(filePath, start, end, chunkSize, encoding):
+    counter = WordCounter(chunkSize, encoding)
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def readShard():
+        with open(filePath, "rb") as file:
+            file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = file.read(min(chunkSize, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
+
+    return counter.countChunks(readShard())
+
+
 class WordCounter:
-    def __init__(self) -> None:
+    def __init__(self, chunkSize=CHUNK_SIZE, encoding=None) -> None:
         self.filePath = ""
+        self.chunkSize = chunkSize
+        self.encoding = encoding
+
+    def countChunks(self, chunks):
+        """Count whitespace separated words over an iterable of text chunks.
+        A word cut in two by a chunk boundary is only counted once.
+        """
+        wordCount = 0
+        endedInWord = False
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+
+            wordCount += len(chunk.split())
+
+            # previous chunk ended mid-word and this one carries on with it
+            if endedInWord and not chunk[0].isspace():
+                wordCount -= 1
+
+            endedInWord = not chunk[-1].isspace()
+
+        return wordCount
+
+    def readChunks(self, stream):
+        while True:
+            chunk = stream.read(self.chunkSize)
+            if not chunk:
+                break
+            yield chunk
+
+    def iterChunkWords(self, chunks):
+        """Yield the words of an iterable of text chunks, gluing back together
+        the words that were cut in two by a chunk boundary.
+        """
+        carry = ""
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+
+            words = chunk.split()
+
+            if carry:
+                if chunk[0].isspace():
+                    yield carry
+                else:
+                    words[0] = carry + words[0]
+                carry = ""
+
+            if words and not chunk[-1].isspace():
+                carry = words.pop()
+
+            yield from words
+
+        if carry:
+            yield carry
+
+    def openText(self, filePath):
+        return io.TextIOWrapper(openBinary(filePath), encoding=self.encoding)
+
+    def iterWords(self, filePath):
+        with self.openText(filePath) as file:
+            yield from self.iterChunkWords(self.readChunks(file))
+
+    def wordFrequencies(self, filePath, approximate=False, **options):
+        """Count how often every word shows up in a file.
+        approximate=True keeps memory bounded with a count-min sketch,
+        options are handed over to the frequency class.
+        """
+        frequencies = ApproxFrequency(**options) if approximate else ExactFrequency()
+        frequencies.update(self.iterWords(filePath))
+        return frequencies
+
+    def countStream(self, stream):
+        return self.countChunks(self.readChunks(stream))
+
+    def countWords(self, filePath):
+        with self.openText(filePath) as file:
+            return self.countStream(file)
+
+    def countAll(self, filePath):
+        """Lines, words, characters, bytes and the longest line of a file,
+        like `wc -lwmcL`, from a single read of the data.
+        Words follow GNU wc too: they are split on ascii whitespace and the unicode
+        spaces, unprintable characters neither start nor end one.
+        """
+        encoding = self.encoding or locale.getpreferredencoding(False)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        lines = words = chars = byteCount = 0
+        longest = column = 0
+        endedInWord = False
+
+        with openBinary(filePath) as file:
+            while True:
+                block = file.read(self.chunkSize)
+                final = not block
+                text = decoder.decode(block, final=final)
+
+                byteCount += len(block)
+                lines += block.count(b"\n")
+                chars += len(text)
+
+                wordText = text.translate(WC_WORD_TABLE)
+                if wordText:
+                    words += len(wordText.split())
+                    if endedInWord and not wordText[0].isspace():
+                        words -= 1
+                    endedInWord = not wordText[-1].isspace()
+
+                if text:
+                    if "\r" in text or "\f" in text:
+                        text = text.translate(LINE_RESETS)
+                    segments = text.split("\n")
+
+                    # every segment but the last one ends a line
+                    for segment in segments[:-1]:
+                        # skip the exact width when even the widest reading can't beat longest
+                        bound = column + 2 * len(segment) + (TAB_SIZE - 1) * segment.count("\t")
+                        if bound > longest:
+                            longest = max(longest, advanceColumn(column, segment))
+                        column = 0
+                    column = advanceColumn(column, segments[-1])
+
+                if final:
+                    break
+
+        return FileStats(lines, words, chars, byteCount, max(longest, column))
+
+    def countBytes(self, data, start, end, endedInWord):
+        window = data[start:end]
+
+        if not window.isascii() and any(lead in window for lead in UNICODE_WHITESPACE_LEADS):
+            window = UNICODE_WHITESPACE_PATTERN.sub(b" ", window)
+
+        marks = window.translate(WORD_TABLE)
+        wordCount = marks.count(b" x")
+
+        if marks[:1] == b"x" and not endedInWord:
+            wordCount += 1
+
+        return wordCount, marks[-1:] == b"x"
+
+    def countWordsMapped(self, filePath):
+        """Count words straight from the memory mapped bytes of a utf-8 file,
+        without decoding it to str or building a list of words.
+        Falls back to countWords when the file can't be mapped.
+        """
+        encoding = codecs.lookup(self.encoding or locale.getpreferredencoding(False)).name
+        if encoding not in ("utf-8", "ascii"):
+            return self.countWords(filePath)
+
+        try:
+            with open(filePath, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # empty files, pipes, character devices...
+            return self.countWords(filePath)
+
+        with data:
+            if findDecompressor(data[:MAGIC_SIZE]) is not None:
+                return self.countWords(filePath)
+
+            wordCount = 0
+            endedInWord = False
+            start = 0
+            size = len(data)
+
+            while start < size:
+                end = min(start + self.chunkSize, size)
+
+                # never cut through a multi-byte character
+                while start < end < size and 0x80 <= data[end] < 0xC0:
+                    end -= 1
+                if end == start:
+                    end = min(start + self.chunkSize, size)
+                    while end < size and 0x80 <= data[end] < 0xC0:
+                        end += 1
+
+                count, endedInWord = self.countBytes(data, start, end, endedInWord)
+                wordCount += count
+                start = end
+
+            return wordCount
+
+    def countWordsParallel(self, filePath, workers=None):
+        """Count words using one process per shard of the file.
+        Shards are cut at whitespace bytes, so other encodings (utf-16, ...)
+        fall back to countWords, like small and compressed files.
+        """
+        workers = workers or os.cpu_count() or 1
+        fileSize = os.path.getsize(filePath)
+        encoding = self.encoding or locale.getpreferredencoding(False)
+
+        if (
+            workers == 1
+            or fileSize < MIN_SHARD_SIZE
+            or not isAsciiCompatible(encoding)
+            or isCompressed(filePath)
+        ):
+            return self.countWords(filePath)
+
+        shards = findShardBoundaries(filePath, workers, self.chunkSize)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(countShard, filePath, start, end, self.chunkSize, encoding)
+                for start, end in shards
+            ]
+            return sum(future.result() for future in futures)
+
+    def countFiles(
+        self, paths, mode="stream", workers=None, cache=None, index=None, allStats=False
+    ):
+        """Count many files on a bounded thread pool so their I/O overlaps.
+        Yields one result dict per file, in the order they finish.
+        Files that did not change since they were put in the cache are not read.
+        OSErrors among the paths (directories expandPaths could not list) are
+        reported like the files that could not be read.
+        With an index, new and changed files are indexed by the same pass that counts them.
+        allStats=True reports every countAll metric instead of only the words.
+        """
+        count = self.countAll if allStats else getattr(self, COUNT_MODES[mode])
+        # the same bytes decode to other words under another encoding,
+        # so counts made with one are never served for another
+        encoding = codecs.lookup(self.encoding or locale.getpreferredencoding(False)).name
+        kind = f"{'stats' if allStats else 'words'}:{encoding}"
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+
+        def countOne(path):
+            try:
+                value = fingerprint = None
+                if cache is not None:
+                    value, fingerprint = cache.lookup(path, kind)
+                cached = value is not None
+
+                if index is not None and not index.isCurrent(path):
+                    words = index.addFile(path, self)
+                    if not allStats:
+                        value = words
+
+                if value is None:
+                    value = count(path)
+
+                if cache is not None and not cached:
+                    cache.store(path, fingerprint, value, kind)
+
+                result = {"path": path}
+                if allStats:
+                    result.update(FileStats(*value)._asdict())
+                else:
+                    result["words"] = value
+                if cached:
+                    result["cached"] = True
+                return result
+            except (OSError, UnicodeDecodeError) as error:
+                return {"path": path, "error": str(error)}
+
+        # keep only a few files queued per worker, paths may be a huge generator
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+
+            for path in paths:
+                if isinstance(path, OSError):
+                    yield {"path": path.filename, "error": str(path)}
+                    continue
+
+                pending.add(executor.submit(countOne, path))
+
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
 
     def openNreadFile(self):
         filePath = input("enter the file path: ")
 
         try:
-            with open(filePath, "r") as file:
-                allText = "".join(file.readlines())
-                finalWordCount = len(allText.split())
-                print(f"Word count = {finalWordCount}")
+            finalWordCount = self.countWords(filePath)
+            print(f"Word count = {finalWordCount}")
         except FileNotFoundError:
             print("File not found. Please check the file path and try again.")
 
@@ -23,6 +618,79 @@ class WordCounter:
                 break
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Count words in files. Without paths it asks for them interactively."
+    )
+    parser.add_argument("paths", nargs="*", help="files, directories or glob patterns")
+    parser.add_argument("-m", "--mode", choices=COUNT_MODES, default="stream")
+    parser.add_argument("-w", "--workers", type=int, help="size of the thread pool")
+    parser.add_argument("-e", "--encoding", help="text encoding of the files")
+    parser.add_argument("--cache", help="json file that keeps the counts between runs")
+    parser.add_argument(
+        "--cache-size", type=int, default=100_000, help="most files kept in the cache"
+    )
+    parser.add_argument(
+        "--hash",
+        action="store_true",
+        help="hash file contents so touched but unchanged files still hit the cache",
+    )
+    parser.add_argument(
+        "--index", help="inverted index file to update, query it with invertedIndex.py"
+    )
+    parser.add_argument(
+        "--wc",
+        action="store_true",
+        help="report lines, words, chars, bytes and the longest line like wc -lwmcL",
+    )
+    args = parser.parse_args(argv)
+
+    application = WordCounter(encoding=args.encoding)
+
+    if not args.paths:
+        application.run()
+        return 0
+
+    cache = None
+    if args.cache:
+        cache = CountCache(args.cache, args.cache_size, args.hash)
+
+    index = None
+    if args.index:
+        index = InvertedIndex.load(args.index)
+        index.prune()
+
+    totalWords = fileCount = errorCount = 0
+    totals = dict.fromkeys(FileStats._fields, 0)
+    results = application.countFiles(
+        expandPaths(args.paths), args.mode, args.workers, cache, index, args.wc
+    )
+
+    for result in results:
+        if "error" in result:
+            errorCount += 1
+        else:
+            fileCount += 1
+            totalWords += result["words"]
+            if args.wc:
+                for field in FileStats._fields:
+                    if field == "maxLineLength":
+                        totals[field] = max(totals[field], result[field])
+                    else:
+                        totals[field] += result[field]
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    if cache is not None:
+        cache.save()
+    if index is not None:
+        index.save(args.index)
+
+    total = {"total": totalWords, "files": fileCount, "errors": errorCount}
+    if args.wc:
+        total.update(totals)
+    sys.stdout.write(json.dumps(total) + "\n")
+    return 1 if errorCount else 0
+
+
 if __name__ == "__main__":
-    application = WordCounter()
-    application.run()
+    sys.exit(main())
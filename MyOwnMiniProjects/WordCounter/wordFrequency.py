@@ -0,0 +1,124 @@
+"""Word frequencies and top-K words for WordCounter.
+
+ExactFrequency keeps one counter per distinct word.
+ApproxFrequency keeps a fixed size count-min sketch plus a small heap of
+the heaviest words, so memory does not grow with the vocabulary.
+"""
+
+import heapq
+from array import array
+from collections import Counter
+from itertools import islice
+
+MASK_64 = (1 << 64) - 1
+
+# words are pre-counted in batches this big, so a word that repeats a lot
+# inside a batch only touches the sketch once
+BATCH_SIZE = 100_000
+
+
+def batches(words, size=BATCH_SIZE):
+    words = iter(words)
+    while True:
+        batch = list(islice(words, size))
+        if not batch:
+            break
+        yield batch
+
+
+class ExactFrequency:
+    def __init__(self) -> None:
+        self.counts = Counter()
+        self.total = 0
+
+    def add(self, word, count=1):
+        self.counts[word] += count
+        self.total += count
+
+    def update(self, words):
+        for batch in batches(words):
+            self.counts.update(batch)
+            self.total += len(batch)
+
+    def estimate(self, word):
+        return self.counts[word]
+
+    def mostCommon(self, k=10):
+        return self.counts.most_common(k)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class ApproxFrequency:
+    """Count-min sketch with conservative updates.
+    Estimates are never below the real count and are at most
+    total * e / width above it, with probability 1 - exp(-depth).
+    """
+
+    def __init__(self, width=1 << 20, depth=4, topK=10) -> None:
+        self.width = width
+        self.depth = depth
+        self.topK = topK
+        self.table = array("Q", bytes(8 * width * depth))
+        self.total = 0
+
+        # heavy hitters: word -> estimate, plus a min-heap of (estimate, word)
+        # heap entries can lag behind the dict, estimates only ever go up
+        self.heavy = {}
+        self.heap = []
+
+    def cells(self, word):
+        # double hashing: depth indexes out of two 64-bit hashes
+        first = hash(word) & MASK_64
+        second = ((first * 0x9E3779B97F4A7C15) & MASK_64) >> 11 | 1
+        return [
+            row * self.width + (first + row * second) % self.width
+            for row in range(self.depth)
+        ]
+
+    def add(self, word, count=1):
+        table = self.table
+        cells = self.cells(word)
+        estimate = min(table[cell] for cell in cells) + count
+
+        # conservative update: only raise the counters that are too low
+        for cell in cells:
+            if table[cell] < estimate:
+                table[cell] = estimate
+
+        self.total += count
+        self.trackHeavy(word, estimate)
+
+    def update(self, words):
+        add = self.add
+        for batch in batches(words):
+            for word, count in Counter(batch).items():
+                add(word, count)
+
+    def trackHeavy(self, word, estimate):
+        if word in self.heavy:
+            self.heavy[word] = estimate
+            return
+
+        if len(self.heavy) < self.topK:
+            self.heavy[word] = estimate
+            heapq.heappush(self.heap, (estimate, word))
+            return
+
+        # bring the smallest heap entry up to date before comparing
+        while self.heap[0][0] != self.heavy[self.heap[0][1]]:
+            smallestWord = self.heap[0][1]
+            heapq.heapreplace(self.heap, (self.heavy[smallestWord], smallestWord))
+
+        if estimate > self.heap[0][0]:
+            _, evicted = heapq.heapreplace(self.heap, (estimate, word))
+            del self.heavy[evicted]
+            self.heavy[word] = estimate
+
+    def estimate(self, word):
+        return min(self.table[cell] for cell in self.cells(word))
+
+    def mostCommon(self, k=None):
+        k = self.topK if k is None else min(k, self.topK)
+        return sorted(self.heavy.items(), key=lambda item: (-item[1], item[0]))[:k]
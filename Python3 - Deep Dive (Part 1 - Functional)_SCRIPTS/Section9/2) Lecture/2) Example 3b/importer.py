@@ -1,32 +1,598 @@
+import contextlib
+import hashlib
+import importlib.abc
+import importlib.util
+import json
+import marshal
 import os.path
+import struct
+import threading
 import types
 import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import MAGIC_NUMBER
+from time import perf_counter
 
 print("Running importer")
 
+# compiled code is cached in <module_path>/__importcache__/<file>.<cache_tag>.bin,
+# like __pycache__ but written and checked by import_ itself
+CACHE_DIR = "__importcache__"
 
-def import_(module_name, module_file, module_path):
-    if module_name in sys.modules:
-        return sys.modules[module_name]
+# magic number of this python, how the entry is validated,
+# then mtime_ns + size of the source or a 16 byte hash of it
+CACHE_HEADER = struct.Struct("<4sI16s")
+VALIDATE_MTIME = 0
+VALIDATE_HASH = 1
+
+# one lock per module name, alive while some thread uses it
+_module_locks = weakref.WeakValueDictionary()
+_module_locks_lock = threading.Lock()
+
+# thread id -> the _ModuleLock the thread waits for, the edges of the wait-for graph
+_blocking_on = {}
+_blocking_on_lock = threading.Lock()
+
+# modules in sys.modules whose code is still running
+_initializing = set()
+
+# the ImportProfile of profile_imports(), None while imports are not profiled
+_profile = None
+
+
+def cache_path(module_abs_file_path):
+    directory, file_name = os.path.split(module_abs_file_path)
+    base_name = os.path.splitext(file_name)[0]
+    tag = sys.implementation.cache_tag
+    return os.path.join(directory, CACHE_DIR, f"{base_name}.{tag}.bin")
+
+
+class ImportRecord:
+    # one module's import: seconds spent reading (source or cache), compiling
+    # (or unmarshalling cached code) and running it, and the imports it made
+    # while running, so exec includes their time
+
+    def __init__(self, module_name, module_abs_file_path):
+        self.name = module_name
+        self.file = module_abs_file_path
+        self.read = self.compile = self.exec = 0.0
+        self.cached = False
+        self.children = []
+        self.last = perf_counter()
+
+    def mark(self, phase):
+        # the time since the last mark was spent in `phase`
+        now = perf_counter()
+        setattr(self, phase, getattr(self, phase) + now - self.last)
+        self.last = now
+
+    @property
+    def cumulative(self):
+        return self.read + self.compile + self.exec
+
+    @property
+    def self_time(self):
+        return self.cumulative - sum(child.cumulative for child in self.children)
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "file": self.file,
+            "read": self.read,
+            "compile": self.compile,
+            "exec": self.exec,
+            "self": self.self_time,
+            "cumulative": self.cumulative,
+            "cached": self.cached,
+            "children": [child.as_dict() for child in self.children],
+        }
+
+
+class _NoRecord:
+    # stands in for an ImportRecord while imports are not profiled
+    cached = False
+
+    def mark(self, phase):
+        pass
+
+
+_NO_RECORD = _NoRecord()
+
+
+class ImportProfile:
+    # the import tree recorded by profile_imports(), like python -X importtime
+    # imports running in another thread start a tree of their own
+
+    def __init__(self):
+        self.roots = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enter(self, module_name, module_abs_file_path):
+        stack = self.local.__dict__.setdefault("stack", [])
+        record = ImportRecord(module_name, module_abs_file_path)
+        if stack:
+            stack[-1].children.append(record)
+        else:
+            with self.lock:
+                self.roots.append(record)
+        stack.append(record)
+        return record
+
+    def leave(self, record):
+        record.mark("exec")
+        self.local.stack.pop()
+
+    def records(self):
+        for root in self.roots:
+            yield from root.walk()
 
-    module_rel_file_path = os.path.join(module_path, module_file)
-    module_abs_file_path = os.path.abspath(module_rel_file_path)
+    def report(self, sort="self", limit=None):
+        # flat table, slowest first by "self", "cumulative", "read", "compile"
+        # or "exec" time
+        key = {"self": "self_time"}.get(sort, sort)
+        ranked = sorted(
+            (record for _, record in self.records()),
+            key=lambda record: getattr(record, key),
+            reverse=True,
+        )[:limit]
+
+        lines = [
+            f"{'self us':>10} {'cumul. us':>10} {'read us':>10} {'compile us':>10} "
+            f"{'exec us':>10}  module"
+        ]
+        for record in ranked:
+            lines.append(
+                f"{record.self_time * 1e6:>10.0f} {record.cumulative * 1e6:>10.0f} "
+                f"{record.read * 1e6:>10.0f} {record.compile * 1e6:>10.0f} "
+                f"{record.exec * 1e6:>10.0f}  {record.name}"
+                f"{' (cached)' if record.cached else ''}"
+            )
+        return "\n".join(lines)
+
+    def tree(self):
+        # the same layout as python -X importtime, in import order
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for depth, record in self.records():
+            lines.append(
+                f"import time: {record.self_time * 1e6:>9.0f} | "
+                f"{record.cumulative * 1e6:>10.0f} | {'  ' * depth}{record.name}"
+            )
+        return "\n".join(lines)
+
+    def as_json(self):
+        return json.dumps([root.as_dict() for root in self.roots], indent=2)
+
+    def write_json(self, json_path):
+        with open(json_path, "w") as json_file:
+            json_file.write(self.as_json())
+
+
+@contextlib.contextmanager
+def profile_imports():
+    # with profile_imports() as profile: every module import_ runs in the block
+    # (lazy ones when they load) is recorded in profile
+    global _profile
+    previous, _profile = _profile, ImportProfile()
+    try:
+        yield _profile
+    finally:
+        _profile = previous
+
+
+def read_cached_code(cache_file_path, validation, key, record=_NO_RECORD):
+    try:
+        with open(cache_file_path, "rb") as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return None
+    finally:
+        record.mark("read")
+
+    if len(data) < CACHE_HEADER.size:
+        return None
+
+    magic, cached_validation, cached_key = CACHE_HEADER.unpack_from(data)
+    if magic != MAGIC_NUMBER or cached_validation != validation or cached_key != key:
+        return None
+
+    try:
+        code = marshal.loads(memoryview(data)[CACHE_HEADER.size :])
+    except (EOFError, ValueError, TypeError):
+        # a damaged entry, it gets compiled and written again
+        return None
+    finally:
+        record.mark("compile")
+
+    record.cached = True
+    return code
+
+
+def write_cached_code(cache_file_path, validation, key, code):
+    if sys.dont_write_bytecode:
+        return
+
+    data = CACHE_HEADER.pack(MAGIC_NUMBER, validation, key) + marshal.dumps(code)
+    temporary_path = f"{cache_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)
+        # write next to the entry then swap, so no one ever reads half of it
+        with open(temporary_path, "wb") as cache_file:
+            cache_file.write(data)
+        os.replace(temporary_path, cache_file_path)
+    except OSError:
+        # read-only directory and the like, just run without a cache
+        pass
+
+
+def get_code(module_abs_file_path, use_cache=True, validate="mtime", record=_NO_RECORD):
+    # validate="mtime" trusts the source's mtime and size, and skips reading it
+    # on a cache hit, validate="hash" reads and hashes the source every time
+    # record gets the time spent reading and compiling
+    if validate not in ("mtime", "hash"):
+        raise ValueError(f"validate must be 'mtime' or 'hash', not {validate!r}")
+
+    cache_file_path = cache_path(module_abs_file_path)
+    validation = key = None
+
+    if use_cache and validate == "mtime":
+        stat = os.stat(module_abs_file_path)
+        validation = VALIDATE_MTIME
+        key = struct.pack("<QQ", stat.st_mtime_ns, stat.st_size)
+        code = read_cached_code(cache_file_path, validation, key, record)
+        if code is not None:
+            return code
 
     # read source code from file
-    with open(module_rel_file_path, "r") as code_file:
+    with open(module_abs_file_path, "rb") as code_file:
         source_code = code_file.read()
+    record.mark("read")
 
-    # create a module object
-    mod = types.ModuleType(module_name)
-    mod.__file__ = module_abs_file_path
-
-    # set a red in sys.modules
-    sys.modules[module_name] = mod
+    if use_cache and validate == "hash":
+        validation = VALIDATE_HASH
+        key = hashlib.blake2b(source_code, digest_size=16).digest()
+        code = read_cached_code(cache_file_path, validation, key, record)
+        if code is not None:
+            return code
 
     # compile source code
     code = compile(source_code, filename=module_abs_file_path, mode="exec")
 
-    # execute compiled source code
-    exec(code, mod.__dict__)
+    if use_cache:
+        write_cached_code(cache_file_path, validation, key, code)
+    record.mark("compile")
+
+    return code
+
+
+class _DeadlockError(RuntimeError):
+    pass
+
+
+class _ModuleLock:
+    # a re-entrant lock that knows its owner, so a thread that is about to wait
+    # for it can tell whether the owner is (through other locks) waiting for it
+
+    def __init__(self, name):
+        self.name = name
+        self.condition = threading.Condition(threading.Lock())
+        self.owner = None
+        self.count = 0
+
+    def has_deadlock(self):
+        # walk the wait-for graph: owner -> lock it waits for -> that lock's owner ...
+        me = threading.get_ident()
+        owner = self.owner
+        seen = set()
+        while owner is not None and owner not in seen:
+            if owner == me:
+                return True
+            seen.add(owner)
+            lock = _blocking_on.get(owner)
+            if lock is None:
+                return False
+            owner = lock.owner
+        return False
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self.condition:
+            while self.count and self.owner != me:
+                with _blocking_on_lock:
+                    if self.has_deadlock():
+                        raise _DeadlockError(f"deadlock importing {self.name!r}")
+                    _blocking_on[me] = self
+                try:
+                    self.condition.wait()
+                finally:
+                    with _blocking_on_lock:
+                        del _blocking_on[me]
+            self.owner = me
+            self.count += 1
+
+    def release(self):
+        with self.condition:
+            self.count -= 1
+            if not self.count:
+                self.owner = None
+                self.condition.notify_all()
+
+
+def _get_module_lock(module_name):
+    with _module_locks_lock:
+        lock = _module_locks.get(module_name)
+        if lock is None:
+            lock = _ModuleLock(module_name)
+            _module_locks[module_name] = lock
+        return lock
+
+
+class _LazyModule(types.ModuleType):
+    # stands in for a module whose code has not run yet, the first time an
+    # attribute the module doesn't have yet is looked up the code runs and
+    # the object turns into a plain module, so later lookups cost nothing extra
+    # (__name__, __file__ & co. are set up front and never trigger a load)
+
+    def __getattr__(self, name):
+        self._load()
+        if isinstance(self, _LazyModule):
+            # the module's own code is still running further up this thread
+            raise AttributeError(
+                f"partially initialized module {self.__name__!r} "
+                f"has no attribute {name!r}"
+            )
+        return getattr(self, name)
+
+    def __dir__(self):
+        self._load()
+        return types.ModuleType.__dir__(self)
+
+    def _load(self):
+        lock = _get_module_lock(self.__name__)
+        try:
+            lock.acquire()
+        except _DeadlockError:
+            # another thread loads it and waits for us, use what is there so far
+            return
+
+        try:
+            # gone if another thread loaded it while we waited, or we are
+            # already running its code
+            namespace = self.__dict__
+            load = namespace.pop("__lazy_load__", None)
+            if load is None:
+                return
+            before = dict(namespace)
+            try:
+                load()
+            except BaseException:
+                # like a failed eager import_, no half-run module is left in
+                # sys.modules, and whoever kept a reference gets a lazy module
+                # again, that retries (and fails the same way) on its next use
+                for name in list(namespace):
+                    if name not in before:
+                        del namespace[name]
+                namespace.update(before)
+                namespace["__lazy_load__"] = load
+                if sys.modules.get(self.__name__) is self:
+                    del sys.modules[self.__name__]
+                raise
+            # other threads wait on the lock, so they never see it half-run
+            self.__class__ = types.ModuleType
+        finally:
+            lock.release()
+
+
+def exec_module(
+    mod, module_abs_file_path, use_cache=True, validate="mtime", local_namespace=None
+):
+    # local_namespace: a mapping the module-level names are written through,
+    # instead of straight into mod.__dict__ (the reloader records them this way)
+    profile = _profile
+    record = _NO_RECORD
+    if profile is not None:
+        record = profile.enter(mod.__name__, module_abs_file_path)
+
+    try:
+        # get the compiled code, from the cache if the source did not change
+        code = get_code(module_abs_file_path, use_cache, validate, record)
+
+        # execute compiled source code
+        exec(code, mod.__dict__, local_namespace)
+    finally:
+        if profile is not None:
+            profile.leave(record)
+
+
+def import_(
+    module_name,
+    module_file,
+    module_path,
+    use_cache=True,
+    validate="mtime",
+    lazy=False,
+):
+    # lazy=True returns the module right away and only reads, compiles and runs
+    # its code when one of its attributes is first used
+    if module_name in sys.modules and module_name not in _initializing:
+        return sys.modules[module_name]
+
+    # one thread at a time runs a module's code, the others wait and get the
+    # finished module, a circular import inside one thread gets the partial one
+    lock = _get_module_lock(module_name)
+    try:
+        lock.acquire()
+    except _DeadlockError:
+        # two threads importing each other's modules, like python's own import
+        # hand out the partly run module instead of waiting forever
+        return sys.modules[module_name]
+
+    try:
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+
+        module_rel_file_path = os.path.join(module_path, module_file)
+        module_abs_file_path = os.path.abspath(module_rel_file_path)
+
+        # create a module object
+        if lazy:
+            # a missing file should fail here, not at the first attribute access
+            os.stat(module_abs_file_path)
+            mod = _LazyModule(module_name)
+            mod.__lazy_load__ = lambda: exec_module(
+                mod, module_abs_file_path, use_cache, validate
+            )
+        else:
+            mod = types.ModuleType(module_name)
+        mod.__file__ = module_abs_file_path
+        if use_cache:
+            mod.__cached__ = cache_path(module_abs_file_path)
+
+        if lazy:
+            sys.modules[module_name] = mod
+            return mod
+
+        # set a red in sys.modules, marked as still running
+        _initializing.add(module_name)
+        sys.modules[module_name] = mod
+        try:
+            exec_module(mod, module_abs_file_path, use_cache, validate)
+        except BaseException:
+            # no half-run module is left behind for the next import to find
+            del sys.modules[module_name]
+            raise
+        finally:
+            _initializing.discard(module_name)
+
+        return sys.modules[module_name]
+    finally:
+        lock.release()
+
+
+def preload(modules, max_workers=None, **options):
+    # import independent modules in parallel, so their file reads and compiles
+    # overlap (marshal.loads and compile let other threads run in between)
+    # modules: (module_name, module_file, module_path) tuples, options go to import_
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = {
+            module[0]: executor.submit(import_, *module, **options)
+            for module in modules
+        }
+    return {module_name: future.result() for module_name, future in futures.items()}
+
+
+class ImporterLoader(importlib.abc.Loader):
+    # runs modules found by ImporterFinder the way import_ does:
+    # through the code cache, lazily if asked to, and seen by profile_imports()
+
+    def __init__(self, use_cache=True, validate="mtime", lazy=False):
+        self.use_cache = use_cache
+        self.validate = validate
+        self.lazy = lazy
+
+    def exec_module(self, module):
+        module_abs_file_path = module.__spec__.origin
+        if not self.lazy:
+            exec_module(module, module_abs_file_path, self.use_cache, self.validate)
+            return
+
+        # the import system already made the module, turn it into a lazy one
+        module.__lazy_load__ = lambda: exec_module(
+            module, module_abs_file_path, self.use_cache, self.validate
+        )
+        module.__class__ = _LazyModule
+
+
+class ImporterFinder(importlib.abc.MetaPathFinder):
+    # finds plain `import x` modules in its own directories, ahead of python's
+    # finders, listing each directory only once until it changes
+
+    def __init__(self, paths, use_cache=True, validate="mtime", lazy=False):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.loader = ImporterLoader(use_cache, validate, lazy)
+        # directory -> (its mtime_ns when listed, names in it)
+        self.listings = {}
+        self.listings_lock = threading.Lock()
+
+    def listing(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return frozenset()
+
+        with self.listings_lock:
+            listing = self.listings.get(directory)
+        if listing is not None and listing[0] == mtime:
+            return listing[1]
+
+        try:
+            names = frozenset(os.listdir(directory))
+        except OSError:
+            names = frozenset()
+        with self.listings_lock:
+            self.listings[directory] = (mtime, names)
+        return names
+
+    def invalidate_caches(self):
+        with self.listings_lock:
+            self.listings.clear()
+
+    def find_spec(self, fullname, path=None, target=None):
+        parent_name, _, name = fullname.rpartition(".")
+        if parent_name:
+            # submodules only of packages this finder loaded, python's own
+            # packages keep their own finders
+            parent = sys.modules.get(parent_name)
+            parent_spec = getattr(parent, "__spec__", None)
+            if getattr(parent_spec, "loader", None) is not self.loader:
+                return None
+            directories = path
+        else:
+            directories = self.paths
+
+        for directory in directories:
+            names = self.listing(directory)
+
+            if name in names:
+                package_directory = os.path.join(directory, name)
+                if "__init__.py" in self.listing(package_directory):
+                    return self.make_spec(
+                        fullname,
+                        os.path.join(package_directory, "__init__.py"),
+                        [package_directory],
+                    )
+
+            if f"{name}.py" in names:
+                return self.make_spec(fullname, os.path.join(directory, f"{name}.py"))
+
+        return None
+
+    def make_spec(self, fullname, module_abs_file_path, search_locations=None):
+        spec = importlib.util.spec_from_file_location(
+            fullname,
+            module_abs_file_path,
+            loader=self.loader,
+            submodule_search_locations=search_locations,
+        )
+        if self.loader.use_cache:
+            spec.cached = cache_path(module_abs_file_path)
+        return spec
+
+
+def install(paths, use_cache=True, validate="mtime", lazy=False):
+    # put an ImporterFinder for the directories in paths first on sys.meta_path,
+    # so plain import statements get the cache, lazy modules and profiling
+    finder = ImporterFinder(paths, use_cache, validate, lazy)
+    sys.meta_path.insert(0, finder)
+    return finder
+
 
-    return sys.modules[module_name]
+def uninstall(finder):
+    sys.meta_path.remove(finder)
@@ -0,0 +1,323 @@
+import ast
+import collections.abc
+import importlib.util
+import os.path
+import sys
+import threading
+import traceback
+
+import importer
+
+print("Running reloader")
+
+# names a reload never removes, even when the new code doesn't set them
+KEPT_NAMES = {
+    "__name__",
+    "__file__",
+    "__cached__",
+    "__loader__",
+    "__spec__",
+    "__package__",
+    "__path__",
+    "__builtins__",
+}
+
+
+class RecordingNamespace(collections.abc.MutableMapping):
+    # the locals a module's code runs with on a reload: every read and write goes
+    # straight to the module's namespace, and the names written are remembered
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.written = set()
+
+    def __getitem__(self, name):
+        return self.namespace[name]
+
+    def __setitem__(self, name, value):
+        self.namespace[name] = value
+        self.written.add(name)
+
+    def __delitem__(self, name):
+        del self.namespace[name]
+
+    def __iter__(self):
+        return iter(self.namespace)
+
+    def __len__(self):
+        return len(self.namespace)
+
+
+def is_lazy(module):
+    # an import_(..., lazy=True) module whose code has not run yet
+    return "__lazy_load__" in vars(module)
+
+
+def package_of(module):
+    # looks only into the module's __dict__, getattr on a lazy module
+    # would run its code
+    namespace = vars(module)
+    package = namespace.get("__package__")
+    if package is not None:
+        return package
+    if "__path__" in namespace:
+        return module.__name__
+    return module.__name__.rpartition(".")[0]
+
+
+def imported_names(source_code, module):
+    # every module name the source could import: import statements (also the
+    # ones inside functions, to be on the safe side) and import_("name", ...) calls
+    names = set()
+
+    for node in ast.walk(ast.parse(source_code)):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                names.add(alias.name)
+
+        elif isinstance(node, ast.ImportFrom):
+            try:
+                base = importlib.util.resolve_name(
+                    "." * node.level + (node.module or ""), package_of(module)
+                )
+            except (ImportError, ValueError):
+                continue
+            names.add(base)
+            # `from package import submodule` imports the submodule as well
+            for alias in node.names:
+                names.add(f"{base}.{alias.name}")
+
+        elif (
+            isinstance(node, ast.Call)
+            and getattr(node.func, "id", getattr(node.func, "attr", None)) == "import_"
+            and node.args
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+        ):
+            names.add(node.args[0].value)
+
+    # importing a.b.c imports a and a.b first
+    for name in list(names):
+        while "." in name:
+            name = name.rpartition(".")[0]
+            names.add(name)
+
+    return names
+
+
+def reload_order(names, dependencies, import_order):
+    # the modules in names, each one after the modules it imports,
+    # an import cycle is broken at the module that was imported first
+    remaining = {name: dependencies.get(name, set()) & names for name in names}
+    order = []
+
+    while remaining:
+        ready = [name for name, waiting_for in remaining.items() if not waiting_for]
+        if not ready:
+            ready = [min(remaining, key=import_order.get)]
+
+        ready.sort(key=import_order.get)
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+        for waiting_for in remaining.values():
+            waiting_for.difference_update(ready)
+
+    return order
+
+
+class Reloader:
+    # watches the source files of the loaded modules under paths and reloads the
+    # ones that changed, and every module importing them (directly or not),
+    # in place, so other modules' references to the module objects stay valid
+
+    def __init__(self, paths, use_cache=True, validate="mtime"):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.use_cache = use_cache
+        self.validate = validate
+
+        # module name -> (mtime_ns, size) of its source when last loaded
+        self.stamps = {}
+        # module name -> names of the tracked modules it imports
+        self.dependencies = {}
+
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.scan()
+
+    def is_tracked(self, module):
+        # (sys.modules may hold objects without a __dict__)
+        file_path = getattr(module, "__dict__", {}).get("__file__")
+        if not file_path or not file_path.endswith(".py"):
+            return False
+        # the running script, the reloader and the importer (with its locks)
+        # can't be swapped out under themselves
+        if module.__name__ in ("__main__", __name__, importer.__name__):
+            return False
+
+        file_path = os.path.abspath(file_path)
+        return any(
+            os.path.commonpath([path, file_path]) == path for path in self.paths
+        )
+
+    def tracked_modules(self):
+        return {
+            name: module
+            for name, module in list(sys.modules.items())
+            if module is not None and self.is_tracked(module)
+        }
+
+    def read_dependencies(self, module):
+        try:
+            with open(module.__file__, "rb") as code_file:
+                return imported_names(code_file.read(), module)
+        except (OSError, SyntaxError):
+            # unreadable or half saved, the next change will try again
+            return set()
+
+    def scan(self):
+        # returns the names of the tracked modules whose source changed,
+        # modules seen for the first time are only remembered
+        changed = set()
+
+        for name, module in self.tracked_modules().items():
+            try:
+                stat = os.stat(module.__file__)
+            except OSError:
+                # deleted (or being replaced), keep the module as it is
+                continue
+
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if name not in self.stamps:
+                self.dependencies[name] = self.read_dependencies(module)
+            elif self.stamps[name] != stamp:
+                self.dependencies[name] = self.read_dependencies(module)
+                changed.add(name)
+            self.stamps[name] = stamp
+
+        return changed
+
+    def dependents(self, names):
+        # names plus every tracked module that imports one of them, directly or not
+        affected = set(names)
+        queue = list(names)
+
+        while queue:
+            name = queue.pop()
+            for other, imports in self.dependencies.items():
+                if name in imports and other not in affected:
+                    affected.add(other)
+                    queue.append(other)
+
+        return affected
+
+    def reload_module(self, module):
+        # run the module's code again over its own namespace, then drop the old
+        # names the new code no longer sets, so deleted functions and classes
+        # don't linger; the namespace is never emptied, so other threads using
+        # the module meanwhile see the old or the new version of every name
+        namespace = module.__dict__
+        previous = dict(namespace)
+        recording = RecordingNamespace(namespace)
+
+        # no import_ of the module runs while it is half reloaded
+        lock = importer._get_module_lock(module.__name__)
+        lock.acquire()
+        try:
+            importer.exec_module(
+                module,
+                os.path.abspath(module.__file__),
+                self.use_cache,
+                self.validate,
+                recording,
+            )
+        except BaseException:
+            # a broken edit leaves the module as it was before
+            for name in list(namespace):
+                if name not in previous:
+                    del namespace[name]
+            namespace.update(previous)
+            raise
+        else:
+            for name, value in previous.items():
+                # set again by the new code (a `global` in a function it called
+                # writes past the recording, hence the identity check)
+                if name in recording.written or namespace.get(name) is not value:
+                    continue
+                if name not in KEPT_NAMES:
+                    del namespace[name]
+        finally:
+            lock.release()
+
+    def check(self):
+        # reload what changed since the last check, returns (names of the
+        # reloaded modules in reload order, {name: exception} of the failed ones)
+        with self.lock:
+            changed = self.scan()
+            if not changed:
+                return [], {}
+
+            modules = self.tracked_modules()
+            import_order = {name: position for position, name in enumerate(sys.modules)}
+            affected = self.dependents(changed) & set(modules)
+
+            reloaded = []
+            errors = {}
+            for name in reload_order(affected, self.dependencies, import_order):
+                # a lazy module that hasn't loaded yet will run the new code anyway
+                if is_lazy(modules[name]):
+                    continue
+                # a module importing a module that failed would pick up old code
+                failed = self.dependencies.get(name, set()) & set(errors)
+                if failed:
+                    errors[name] = ImportError(
+                        f"not reloaded, {', '.join(sorted(failed))} failed to reload"
+                    )
+                    continue
+                try:
+                    self.reload_module(modules[name])
+                except Exception as error:
+                    errors[name] = error
+                else:
+                    reloaded.append(name)
+
+            # reloading may import new modules, and touches no sources itself
+            self.scan()
+            return reloaded, errors
+
+    def watch(self, interval=0.05, on_reload=None):
+        # check every `interval` seconds until stop(), on_reload(reloaded, errors)
+        # is called after every check that found something
+        while not self.stopping.wait(interval):
+            reloaded, errors = self.check()
+            if not reloaded and not errors:
+                continue
+            if on_reload is not None:
+                on_reload(reloaded, errors)
+            else:
+                report(reloaded, errors)
+
+    def start(self, interval=0.05, on_reload=None):
+        # watch in a background (daemon) thread
+        self.stopping.clear()
+        self.thread = threading.Thread(
+            target=self.watch, args=(interval, on_reload), name="reloader", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def report(reloaded, errors):
+    for name in reloaded:
+        print(f"reloaded {name}")
+    for name, error in errors.items():
+        print(f"reloading {name} failed:", file=sys.stderr)
+        traceback.print_exception(error, file=sys.stderr)
@@ -7,36 +7,1542 @@ over multiple iterations
 
 from time import perf_counter
 from collections import namedtuple
+from functools import partial
+from itertools import product, repeat
 import argparse
+import ast
+import asyncio
+import builtins
+import cProfile
+import fnmatch
+import gc
+import importlib.util
+import inspect
+import json
+import linecache
+import math
+import multiprocessing
+import os
+import pstats
+import random
+import statistics
+import sys
+import tracemalloc
 
-Timing = namedtuple("Timing", "repeats elapsed average")
+# repeats: loops per round, elapsed: all rounds together, average: per loop
+# min ... p95 and samples: seconds per loop, one sample per round
+# memory: a Memory record when timeit(memory=True), None otherwise
+Timing = namedtuple(
+    "Timing",
+    "repeats elapsed average rounds min median mean stdev p5 p95 samples memory",
+    defaults=(None,),
+)
 
+# peak: most bytes held on top of what setup left behind, during one traced round
+# blocks_per_loop, bytes_per_loop: what every loop leaves allocated (net, after frees)
+# top_sites: (file:line, bytes, blocks) of the biggest net allocations
+# gc_collections: collections per generation during the timed rounds
+Memory = namedtuple(
+    "Memory", "loops peak blocks_per_loop bytes_per_loop top_sites gc_collections"
+)
 
-def timeit(code, repeats=10):
-    code = compile(code, filename="<string>", mode="exec")
-    start = perf_counter()
+# by_cumulative, by_self: (function, calls, self seconds, cumulative seconds) rows
+# lines: (file:line, hits, seconds, source) rows, None unless profile(lines=True)
+Profile = namedtuple("Profile", "loops by_cumulative by_self lines")
 
-    for _ in range(repeats):
-        exec(code)
+# baseline: the saved Timing, change: relative change of the median (+0.1 = 10% slower)
+# verdict: "slower", "faster" or "same"
+Comparison = namedtuple(
+    "Comparison", "name baseline current change significant verdict"
+)
 
-    end = perf_counter()
-    elapsed = end - start
-    average = elapsed / repeats
-    return Timing(repeats, elapsed, average)
+# latencies of single awaits in seconds, p50 ... p99 are percentiles
+Latency = namedtuple("Latency", "count min mean p50 p90 p99 max")
 
+# timing: per await wall time, with concurrency > 1 that is 1 / throughput
+# throughput: awaits completed per second (median round)
+AsyncTiming = namedtuple("AsyncTiming", "timing concurrency throughput latency")
 
-if __name__ == "__main__":
+# speedup: how many times faster than the baseline snippet (median of the
+# per-round ratios), low ... high: its bootstrap confidence interval
+Speedup = namedtuple("Speedup", "name baseline speedup low high confidence")
+
+# attribute benchmark() puts on the functions it marks
+BENCHMARK_ATTRIBUTE = "__timing_benchmark__"
+
+# a function of a benchmark file, by reference, so it can be sent to a worker
+# process: path and root locate the file (see load_module), name is the function's
+# name in it, args and kwargs are bound to it when the worker imports it
+SuiteCall = namedtuple("SuiteCall", "path root name args kwargs")
+
+# two-sided 95% critical values of Student's t, by degrees of freedom
+T_CRITICAL_95 = (
+    (1, 12.706),
+    (2, 4.303),
+    (3, 3.182),
+    (4, 2.776),
+    (5, 2.571),
+    (6, 2.447),
+    (7, 2.365),
+    (8, 2.306),
+    (9, 2.262),
+    (10, 2.228),
+    (12, 2.179),
+    (15, 2.131),
+    (20, 2.086),
+    (25, 2.060),
+    (30, 2.042),
+    (60, 2.000),
+    (120, 1.980),
+)
+
+# tracing slows snippets down a lot, so the traced round is kept short
+MEMORY_LOOPS = 1000
+PROFILE_LOOPS = 1000
+
+# loop counts tried when calibrating: 1, 2, 5, 10, 20, 50, ...
+CALIBRATION_STEPS = (1, 2, 5)
+
+TIME_UNITS = (("s", 1.0), ("ms", 1e-3), ("us", 1e-6), ("ns", 1e-9))
+
+
+# string snippets are compiled into a function with the loop inside,
+# so each loop costs no more than the snippet itself (same trick as the timeit module);
+# string setup and teardown go into the same function, outside the timed region,
+# so names they create are the snippet's local variables too
+# (_setup, _code and _teardown are replaced by compile_loop);
+# _started and _finished are called right around the timed region
+LOOP_TEMPLATE = """
+def _timing_loop(_iterations, _timer, _started, _finished):
+    _setup
+    try:
+        _started()
+        _start = _timer()
+        for _ in _iterations:
+            _code
+        _elapsed = _timer() - _start
+        _finished()
+        return _elapsed
+    finally:
+        _teardown
+"""
+
+# string snippets for timeit_async become the body of a coroutine function,
+# so they can use await
+ASYNC_STEP_TEMPLATE = """
+async def _timing_step():
+    _code
+"""
+
+
+def do_nothing():
+    pass
+
+
+def make_namespace(globals=None):
+    """A fresh module-like namespace, so snippets never see the harness's variables."""
+    namespace = {"__name__": "__timing__", "__builtins__": builtins}
+    if globals is not None:
+        namespace.update(globals)
+    return namespace
+
+
+def register_source(code, filename):
+    """Put a snippet into linecache, so tracebacks and profiles can show its lines."""
+    # no mtime: linecache.checkcache() leaves entries without one alone
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+
+def make_step(code, namespace, filename="<timing>"):
+    """Turn a snippet (string or callable) into a function that runs it untimed."""
+    if code is None:
+        return lambda: None
+    if callable(code):
+        return code
+
+    register_source(code, filename)
+    compiled = compile(code, filename=filename, mode="exec")
+    return lambda: exec(compiled, namespace)
+
+
+def loop_source(code, setup=None, teardown=None):
+    """The source registered for <timing>: the snippet, then setup and teardown.
+    compile_loop numbers their lines to match.
+    """
+    parts = [part for part in (code, setup, teardown) if part is not None]
+    return "".join(f"{line}\n" for part in parts for line in part.splitlines())
+
+
+# nodes with a scope of their own, what they bind stays inside them
+NESTED_SCOPES = (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def bound_names(code):
+    """Names a snippet binds at its own level: assignments, imports, defs...
+    (not the ones inside the functions, classes and comprehensions it defines).
+    """
+    names = set()
+    pending = list(ast.parse(code).body)
+
+    while pending:
+        node = pending.pop()
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, ast.alias):
+            if node.name != "*":
+                names.add(node.asname or node.name.partition(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            continue
+        if isinstance(node, NESTED_SCOPES):
+            continue
+        pending.extend(ast.iter_child_nodes(node))
+
+    return names
+
+
+def compile_loop(
+    code, template=LOOP_TEMPLATE, setup=None, teardown=None, global_names=()
+):
+    """Compile a template (LOOP_TEMPLATE by default) with the snippet, setup and
+    teardown in place of its _code, _setup and _teardown placeholders.
+    The template itself is put on line 0 so the snippet keeps its own line numbers
+    in tracebacks, allocation sites and profiles, and the loop's overhead never
+    gets mixed up with the snippet's first line. Setup and teardown lines are
+    numbered after the snippet's, as in loop_source().
+    global_names are declared global at the top of the snippet.
+    """
+    tree = ast.parse(template)
+    for node in ast.walk(tree):
+        if hasattr(node, "lineno"):
+            node.lineno = node.end_lineno = 0
+
+    bodies = {"_code": ast.parse(code).body}
+    if global_names:
+        bodies["_code"].insert(
+            0, ast.Global(names=sorted(global_names), lineno=0, col_offset=0)
+        )
+    offset = len(code.splitlines())
+    for placeholder, part in (("_setup", setup), ("_teardown", teardown)):
+        if part is None:
+            bodies[placeholder] = [ast.Pass(lineno=0, col_offset=0)]
+            continue
+        part_tree = ast.parse(part)
+        ast.increment_lineno(part_tree, offset)
+        bodies[placeholder] = part_tree.body
+        offset += len(part.splitlines())
+
+    for node in list(ast.walk(tree)):
+        for field in ("body", "finalbody"):
+            body = getattr(node, field, None)
+            if not isinstance(body, list):
+                continue
+            for position, statement in enumerate(body):
+                if (
+                    isinstance(statement, ast.Expr)
+                    and isinstance(statement.value, ast.Name)
+                    and statement.value.id in bodies
+                ):
+                    body[position : position + 1] = bodies[statement.value.id]
+                    break
+
+    return compile(ast.fix_missing_locations(tree), filename="<timing>", mode="exec")
+
+
+def make_loop(code, namespace, setup=None, teardown=None):
+    """Return (loop, setup, teardown), loop(repeats) -> seconds taken by `repeats`
+    runs of the snippet. A string snippet takes string setup and teardown into its
+    loop function, the setup and teardown returned are the ones left to run around
+    the loop (None when there are none).
+    loop(repeats, started, finished) calls started() and finished() right before
+    and after the timed region, past any setup and before any teardown.
+    """
+    if callable(code):
+
+        def loop(repeats, started=do_nothing, finished=do_nothing):
+            started()
+            start = perf_counter()
+            for _ in repeat(None, repeats):
+                code()
+            elapsed = perf_counter() - start
+            finished()
+            return elapsed
+
+        return loop, setup, teardown
+
+    inner_setup = setup if isinstance(setup, str) else None
+    inner_teardown = teardown if isinstance(teardown, str) else None
+    try:
+        exec(compile_loop(code, LOOP_TEMPLATE, inner_setup, inner_teardown), namespace)
+    except SyntaxError:
+        # some snippets can't live inside a function (star imports, ...),
+        # the snippet, setup and teardown then run in the namespace itself
+        register_source(code, "<timing>")
+        compiled = compile(code, filename="<timing>", mode="exec")
+
+        def loop(repeats, started=do_nothing, finished=do_nothing):
+            started()
+            start = perf_counter()
+            for _ in repeat(None, repeats):
+                exec(compiled, namespace)
+            elapsed = perf_counter() - start
+            finished()
+            return elapsed
+
+        return loop, setup, teardown
+
+    register_source(loop_source(code, inner_setup, inner_teardown), "<timing>")
+    inner = namespace.pop("_timing_loop")
+
+    def loop(repeats, started=do_nothing, finished=do_nothing):
+        return inner(repeat(None, repeats), perf_counter, started, finished)
+
+    outer_setup = None if inner_setup is not None else setup
+    outer_teardown = None if inner_teardown is not None else teardown
+    return loop, outer_setup, outer_teardown
+
+
+def make_round(code, setup=None, teardown=None, globals=None):
+    """Return run_round(repeats) -> seconds, with setup and teardown around the loop.
+    run_round(repeats, started, finished) passes the hooks on to the loop (make_loop).
+    """
+    namespace = make_namespace(globals)
+    loop, setup, teardown = make_loop(code, namespace, setup, teardown)
+    setup = make_step(setup, namespace, "<timing-setup>")
+    teardown = make_step(teardown, namespace, "<timing-teardown>")
+
+    def run_round(repeats, started=do_nothing, finished=do_nothing):
+        setup()
+        try:
+            return loop(repeats, started, finished)
+        finally:
+            teardown()
+
+    return run_round
+
+
+def calibrate(run_round, target=0.2):
+    """Find how many loops it takes for one round to last at least `target` seconds."""
+    multiplier = 1
+
+    while True:
+        for step in CALIBRATION_STEPS:
+            repeats = step * multiplier
+            if run_round(repeats) >= target:
+                return repeats
+        multiplier *= 10
+
+
+def gc_collections():
+    return [generation["collections"] for generation in gc.get_stats()]
+
+
+def trace_memory(run_traced, repeats, top=10, frames=1):
+    """Run one round of `repeats` loops under tracemalloc, summarize its allocations.
+    run_traced(repeats, started, finished) is a run_round, tracing covers only the
+    loop itself, setup and teardown run before and after it.
+    """
+    before = after = None
+    base = peak = 0
+
+    def started():
+        nonlocal before, base
+        tracemalloc.start(frames)
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+
+    def finished():
+        nonlocal after, peak
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    try:
+        run_traced(repeats, started, finished)
+    finally:
+        tracemalloc.stop()
+
+    # leave out what the harness and tracemalloc allocate for themselves
+    harness = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]
+    before = before.filter_traces(harness)
+    after = after.filter_traces(harness)
+
+    differences = after.compare_to(before, "lineno")
+    top_sites = [
+        (str(difference.traceback[0]), difference.size_diff, difference.count_diff)
+        for difference in differences[:top]
+        if difference.size_diff or difference.count_diff
+    ]
+
+    return (
+        peak - base,
+        sum(difference.count_diff for difference in differences) / repeats,
+        sum(difference.size_diff for difference in differences) / repeats,
+        top_sites,
+    )
+
+
+def summarize(repeats, round_times):
+    samples = [round_time / repeats for round_time in round_times]
+    elapsed = sum(round_times)
+
+    if len(samples) > 1:
+        stdev = statistics.stdev(samples)
+        percentiles = statistics.quantiles(samples, n=20, method="inclusive")
+        p5, p95 = percentiles[0], percentiles[-1]
+    else:
+        stdev = 0.0
+        p5 = p95 = samples[0]
+
+    return Timing(
+        repeats,
+        elapsed,
+        elapsed / (repeats * len(samples)),
+        len(samples),
+        min(samples),
+        statistics.median(samples),
+        statistics.mean(samples),
+        stdev,
+        p5,
+        p95,
+        tuple(samples),
+    )
+
+
+def timeit(
+    code,
+    repeats=10,
+    rounds=5,
+    warmup=1,
+    target=0.2,
+    setup=None,
+    teardown=None,
+    globals=None,
+    memory=False,
+    top=10,
+):
+    """Time `code` over `rounds` independent rounds of `repeats` loops each.
+    warmup loops run first and are not timed.
+    With repeats=None the loop count is calibrated so a round lasts `target` seconds.
+
+    code, setup and teardown can be strings or callables taking no arguments.
+    setup and teardown run before and after every round, outside the timed region.
+    Strings run in a fresh namespace, pre-filled with `globals` if given.
+
+    memory=True also counts gc collections during the timed rounds and runs
+    one extra traced round to report allocations (see Memory).
+    """
+    run_round = make_round(code, setup, teardown, globals)
+    run_round(warmup)
+
+    if repeats is None:
+        repeats = calibrate(run_round, target)
+
+    collections_before = gc_collections()
+    round_times = [run_round(repeats) for _ in range(rounds)]
+    collections = [
+        after - before for before, after in zip(collections_before, gc_collections())
+    ]
+
+    timing = summarize(repeats, round_times)
+    if not memory:
+        return timing
+
+    loops = min(repeats, MEMORY_LOOPS)
+    peak, blocks_per_loop, bytes_per_loop, top_sites = trace_memory(
+        run_round, loops, top
+    )
+    return timing._replace(
+        memory=Memory(
+            loops, peak, blocks_per_loop, bytes_per_loop, top_sites, collections
+        )
+    )
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p90, p99 = percentiles[49], percentiles[89], percentiles[98]
+    else:
+        p50 = p90 = p99 = latencies[0]
+
+    return Latency(
+        len(latencies),
+        latencies[0],
+        statistics.mean(latencies),
+        p50,
+        p90,
+        p99,
+        latencies[-1],
+    )
+
+
+def make_async_step(code, namespace, shared_names=()):
+    """Turn a snippet (string or coroutine function) into a coroutine function.
+    Every await runs the step anew, so state kept between awaits lives in the
+    namespace: shared_names (what setup and globals provide) the snippet binds
+    are declared global in the step, so `x += 1` updates the namespace's x.
+    """
+    if callable(code):
+        return code
+
+    register_source(code, "<timing>")
+    global_names = bound_names(code) & set(shared_names)
+    exec(compile_loop(code, ASYNC_STEP_TEMPLATE, global_names=global_names), namespace)
+    return namespace.pop("_timing_step")
+
+
+def timeit_async(
+    code,
+    repeats=None,
+    rounds=5,
+    warmup=1,
+    target=0.2,
+    concurrency=1,
+    setup=None,
+    teardown=None,
+    globals=None,
+    loop_factory=None,
+):
+    """Time an async snippet on an event loop of its own.
+    code is a coroutine function (or anything returning an awaitable), or a string
+    that becomes the body of one, so it can use await. Each round awaits it
+    `repeats` times, with `concurrency` of those awaits in flight at once, and the
+    latency of every single await is recorded.
+    A bare awaitable (a coroutine object, a future) can only be awaited once,
+    so it is timed a single time.
+
+    The loop is made with loop_factory (asyncio.new_event_loop by default) before
+    anything is timed, rounds are timed from inside the running loop, so starting
+    the loop is never part of a measurement. setup and teardown may also be
+    coroutine functions. The other arguments are the same as for timeit.
+    Returns an AsyncTiming.
+    """
+    loop = (loop_factory or asyncio.new_event_loop)()
+
+    def run_step(step):
+        result = step()
+        if inspect.isawaitable(result):
+            loop.run_until_complete(result)
+
+    async def run_once(awaitable):
+        start = perf_counter()
+        await awaitable
+        return perf_counter() - start
+
+    async def run_awaits(repeats, latencies):
+        remaining = repeats
+
+        async def worker():
+            nonlocal remaining
+            while remaining:
+                remaining -= 1
+                start = perf_counter()
+                await step()
+                latencies.append(perf_counter() - start)
+
+        start = perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, repeats))))
+        return perf_counter() - start
+
+    def run_round(repeats, latencies=None):
+        run_step(setup)
+        try:
+            return loop.run_until_complete(
+                run_awaits(repeats, [] if latencies is None else latencies)
+            )
+        finally:
+            run_step(teardown)
+
+    try:
+        if inspect.isawaitable(code):
+            elapsed = loop.run_until_complete(run_once(code))
+            return AsyncTiming(
+                summarize(1, [elapsed]), 1, 1 / elapsed, summarize_latencies([elapsed])
+            )
+
+        namespace = make_namespace(globals)
+        shared_names = set(namespace)
+        if isinstance(setup, str):
+            shared_names |= bound_names(setup)
+        step = make_async_step(code, namespace, shared_names)
+        setup = make_step(setup, namespace, "<timing-setup>")
+        teardown = make_step(teardown, namespace, "<timing-teardown>")
+
+        run_round(warmup)
+        if repeats is None:
+            repeats = calibrate(run_round, target)
+
+        latencies = []
+        timing = summarize(
+            repeats, [run_round(repeats, latencies) for _ in range(rounds)]
+        )
+        return AsyncTiming(
+            timing, concurrency, 1 / timing.median, summarize_latencies(latencies)
+        )
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def bootstrap_interval(values, statistic, confidence=0.95, resamples=2000, rng=random):
+    """Percentile bootstrap confidence interval of statistic(values)."""
+    estimates = sorted(
+        statistic(rng.choices(values, k=len(values))) for _ in range(resamples)
+    )
+    tail = (1 - confidence) / 2
+    return estimates[int(tail * resamples)], estimates[int((1 - tail) * resamples) - 1]
+
+
+def timeit_interleaved(
+    codes,
+    repeats=None,
+    rounds=10,
+    warmup=1,
+    target=0.2,
+    setup=None,
+    teardown=None,
+    globals=None,
+    confidence=0.95,
+    resamples=2000,
+    seed=None,
+):
+    """Time several snippets against each other, with their rounds interleaved.
+    Every round of the run times each snippet once, in a shuffled order, so drift
+    (cpu frequency, heat, other load) hits all of them alike.
+
+    codes is a list of snippets or a dict {name: snippet}; the first one is the
+    baseline the others are compared with. Each gets its own namespace, the other
+    arguments are the same as for timeit (repeats=None calibrates every snippet
+    on its own). seed makes the order and the bootstrap reproducible.
+
+    Returns ({name: Timing}, [Speedup of every other snippet over the baseline]).
+    """
+    if not isinstance(codes, dict):
+        named = {}
+        for position, code in enumerate(codes):
+            # the same snippet twice makes an A/A test, keep both
+            name = str(code) if str(code) not in named else f"{code} #{position + 1}"
+            named[name] = code
+        codes = named
+    rng = random.Random(seed)
+
+    run_rounds = {
+        name: make_round(code, setup, teardown, globals) for name, code in codes.items()
+    }
+    loop_counts = {}
+    for name, run_round in run_rounds.items():
+        run_round(warmup)
+        loop_counts[name] = repeats or calibrate(run_round, target)
+
+    round_times = {name: [] for name in codes}
+    order = list(codes)
+    for _ in range(rounds):
+        rng.shuffle(order)
+        for name in order:
+            round_times[name].append(run_rounds[name](loop_counts[name]))
+
+    timings = {
+        name: summarize(loop_counts[name], times) for name, times in round_times.items()
+    }
+
+    baseline, *others = codes
+    speedups = []
+    for name in others:
+        # rounds i of both snippets ran next to each other, so their ratio is
+        # free of the drift between rounds
+        ratios = [
+            before / after
+            for before, after in zip(timings[baseline].samples, timings[name].samples)
+        ]
+        low, high = bootstrap_interval(
+            ratios, statistics.median, confidence, resamples, rng
+        )
+        speedups.append(
+            Speedup(name, baseline, statistics.median(ratios), low, high, confidence)
+        )
+
+    return timings, speedups
+
+
+def is_harness(filename):
+    return filename == __file__ or filename == cProfile.__file__
+
+
+def profile_functions(run_round, repeats, top=10):
+    """Run one round under cProfile, return its hottest functions
+    by cumulative and by self time.
+    Only the loop is profiled, setup and teardown run before and after it
+    (see make_loop). The profiler starts inside the running loop, so it never
+    sees the loop's own call: its time, with what a string snippet does
+    without calling anything, is put in a "(loop)" row.
+    """
+    profiler = cProfile.Profile()
+    window = 0.0
+
+    def started():
+        nonlocal window
+        profiler.enable()
+        window -= perf_counter()
+
+    def finished():
+        nonlocal window
+        window += perf_counter()
+        profiler.disable()
+
+    try:
+        run_round(repeats, started, finished)
+    finally:
+        profiler.disable()
+
+    rows = []
+    profiled = 0.0
+    for function, (_, calls, self_time, cumulative, _) in pstats.Stats(
+        profiler
+    ).stats.items():
+        profiled += self_time
+        filename, _, name = function
+        if is_harness(filename) or "_lsprof.Profiler" in name:
+            continue
+        rows.append((pstats.func_std_string(function), calls, self_time, cumulative))
+    rows.append(("(loop)", 1, max(window - profiled, 0.0), window))
+
+    by_cumulative = sorted(rows, key=lambda row: row[3], reverse=True)[:top]
+    by_self = sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+    return by_cumulative, by_self
+
+
+class LineTimes(dict):
+    """(file, line) -> [hits, seconds], filled in by the line tracers.
+    A line's time runs from its line event to the next event of the same frame,
+    so it includes the calls made from it. Frames running the same line inside
+    each other (generator expressions, recursion) only count the outermost one.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.running = {}
+
+    def start(self, key):
+        self.setdefault(key, [0, 0.0])[0] += 1
+        self.running[key] = self.running.get(key, 0) + 1
+
+    def stop(self, key, seconds):
+        self.running[key] -= 1
+        if not self.running[key]:
+            self[key][1] += seconds
+
+
+def trace_lines_settrace(run_round, repeats, line_times):
+    # tracing starts in the started hook, inside the loop (after any setup)
+    # and stops in the finished hook, before any teardown
+    def trace_call(frame, event, arg):
+        # [(file, line) running since `start`, start], one per frame
+        current = [None, 0.0]
+
+        def trace_line(frame, event, arg):
+            now = perf_counter()
+            if event == "exception":
+                # the line goes on if the exception is caught in this frame
+                return trace_line
+            if current[0] is not None:
+                line_times.stop(current[0], now - current[1])
+            if event == "line":
+                current[0] = (frame.f_code.co_filename, frame.f_lineno)
+                current[1] = now
+                line_times.start(current[0])
+            else:
+                current[0] = None
+            return trace_line
+
+        return trace_line
+
+    def started():
+        # the loop is already running, so it never gets a call event,
+        # its lines are traced from here on
+        loop_frame = sys._getframe(1)
+        loop_frame.f_trace = trace_call(loop_frame, "call", None)
+        sys.settrace(trace_call)
+
+    def finished():
+        sys.settrace(None)
+
+    try:
+        run_round(repeats, started, finished)
+    finally:
+        sys.settrace(None)
+
+
+def trace_lines_monitoring(run_round, repeats, line_times):
+    monitoring = sys.monitoring
+    events = monitoring.events
+    tool = monitoring.PROFILER_ID
+    # [(file, line) running since `start`, start, code], one per running frame
+    stack = []
+
+    def enter(code, offset, *args):
+        stack.append([None, 0.0, code])
+
+    def leave(code, offset, *args):
+        now = perf_counter()
+        # frames that were running before monitoring started never entered
+        if stack and stack[-1][2] is code:
+            current = stack.pop()
+            if current[0] is not None:
+                line_times.stop(current[0], now - current[1])
+
+    def line(code, line_number):
+        now = perf_counter()
+        if not stack:
+            # a frame that was already running when tracing started
+            return
+        current = stack[-1]
+        if current[0] is not None:
+            line_times.stop(current[0], now - current[1])
+        current[0] = (code.co_filename, line_number)
+        current[1] = now
+        line_times.start(current[0])
+
+    callbacks = {
+        events.PY_START: enter,
+        events.PY_RESUME: enter,
+        events.PY_THROW: enter,
+        events.PY_RETURN: leave,
+        events.PY_YIELD: leave,
+        events.PY_UNWIND: leave,
+        events.LINE: line,
+    }
+
+    monitoring.use_tool_id(tool, "timing")
+    try:
+        wanted = events.NO_EVENTS
+        for event, callback in callbacks.items():
+            monitoring.register_callback(tool, event, callback)
+            wanted |= event
+
+        # events are on only for the loop, not for the setup and teardown
+        # around it; the loop itself is already running, so it is put on the
+        # stack by hand
+        def started():
+            stack.append([None, 0.0, sys._getframe(1).f_code])
+            monitoring.set_events(tool, wanted)
+
+        def finished():
+            monitoring.set_events(tool, events.NO_EVENTS)
+
+        try:
+            run_round(repeats, started, finished)
+        finally:
+            monitoring.set_events(tool, events.NO_EVENTS)
+    finally:
+        for event in callbacks:
+            monitoring.register_callback(tool, event, None)
+        monitoring.free_tool_id(tool)
+
+
+def profile_lines(run_round, repeats, top=10):
+    """Run one round with a line tracer, return the lines that took longest
+    (see LineTimes). Uses sys.monitoring where there is one (3.12+),
+    sys.settrace otherwise.
+    """
+    line_times = LineTimes()
+    if hasattr(sys, "monitoring"):
+        trace_lines_monitoring(run_round, repeats, line_times)
+    else:
+        trace_lines_settrace(run_round, repeats, line_times)
+
+    rows = [
+        (
+            f"{filename}:{line}",
+            hits,
+            seconds,
+            # line 0 of <timing> is the loop compile_loop wraps around the snippet
+            linecache.getline(filename, line).strip() or "(loop)",
+        )
+        for (filename, line), (hits, seconds) in line_times.items()
+        if not is_harness(filename)
+    ]
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+
+def profile(
+    code,
+    repeats=None,
+    warmup=1,
+    target=0.2,
+    setup=None,
+    teardown=None,
+    globals=None,
+    top=10,
+    lines=False,
+):
+    """Show where the time of `code` goes.
+    Runs one round under cProfile and, with lines=True, one more under a line
+    tracer. Both slow the snippet down, so a round is at most PROFILE_LOOPS loops;
+    with repeats=None it is calibrated like in timeit first.
+    Arguments are the same as for timeit, returns a Profile.
+    """
+    run_round = make_round(code, setup, teardown, globals)
+    run_round(warmup)
+
+    if repeats is None:
+        repeats = calibrate(run_round, target)
+    loops = min(repeats, PROFILE_LOOPS)
+
+    by_cumulative, by_self = profile_functions(run_round, loops, top)
+    line_rows = profile_lines(run_round, loops, top) if lines else None
+    return Profile(loops, by_cumulative, by_self, line_rows)
+
+
+def _pin_worker(free_cpus):
+    # each worker process takes one cpu for itself and gives it back when done
+    global _worker_cpu
+    _worker_cpu = free_cpus.get()
+    os.sched_setaffinity(0, {_worker_cpu})
+
+
+def _timeit_task(task):
+    name, options, free_cpus = task
+    options = {
+        key: resolve_call(value) if isinstance(value, SuiteCall) else value
+        for key, value in options.items()
+    }
+    try:
+        return name, timeit(**options)
+    finally:
+        if free_cpus is not None:
+            free_cpus.put(_worker_cpu)
+
+
+def run_isolated(benchmarks, processes=None, pin=False):
+    """Run every benchmark in a fresh worker process, several of them in parallel.
+    benchmarks maps a name to the keyword arguments for timeit, e.g.
+    {"sorted": {"code": "sorted(data)", "setup": "data = list(range(1000))"}}
+    Callables have to be picklable (defined at module level), or SuiteCall
+    references to functions of benchmark files.
+    pin=True gives every worker its own cpu (where the OS supports affinity).
+    Returns {name: Timing} in the same order as benchmarks.
+    """
+    processes = processes or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    manager = free_cpus = initializer = None
+
+    if pin and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        processes = min(processes, len(cpus))
+        manager = context.Manager()
+        free_cpus = manager.Queue()
+        for cpu in cpus:
+            free_cpus.put(cpu)
+        initializer = _pin_worker
+
+    tasks = [(name, options, free_cpus) for name, options in benchmarks.items()]
+
+    try:
+        # maxtasksperchild=1: no benchmark runs in an interpreter another one warmed up
+        with context.Pool(
+            processes,
+            initializer=initializer,
+            initargs=(free_cpus,) if initializer else (),
+            maxtasksperchild=1,
+        ) as pool:
+            results = dict(pool.imap_unordered(_timeit_task, tasks))
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
+    return {name: results[name] for name in benchmarks}
+
+
+def benchmark(params=None, **options):
+    """Mark a function as a benchmark for run_suite().
+    params is a list of values for the function's only argument, or a dict
+    {argument: [values]} whose grid (every combination) is run.
+    The other keyword arguments go to timeit and override the suite's defaults, e.g.
+
+        @timing.benchmark(repeats=100, params={"size": [10, 1000], "reverse": [1, 0]})
+        def bench_sorted(size, reverse):
+            sorted(range(size), reverse=reverse)
+    """
+
+    def mark(function):
+        # an attribute rather than a registry in this module: when timing.py runs
+        # as a script the suite lives in __main__, while the benchmark modules
+        # import (and would register in) a second copy called timing
+        setattr(function, BENCHMARK_ATTRIBUTE, (params, options))
+        return function
+
+    return mark
+
+
+def expand_params(params):
+    """Yield (label, args, kwargs) for every combination of parameters."""
+    if params is None:
+        yield "", (), {}
+    elif isinstance(params, dict):
+        names = list(params)
+        for values in product(*params.values()):
+            kwargs = dict(zip(names, values))
+            label = ", ".join(f"{name}={value!r}" for name, value in kwargs.items())
+            yield f"[{label}]", (), kwargs
+    else:
+        for value in params:
+            yield f"[{value!r}]", (value,), {}
+
+
+def module_name(path, root):
+    relative = os.path.splitext(os.path.relpath(path, root))[0]
+    return relative.replace(os.sep, ".")
+
+
+def load_module(path, root):
+    """Import a benchmark file by path, under a name made from its place in root."""
+    name = module_name(path, root)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # registered like any import, so pickle, dataclasses & co. can find it
+    sys.modules[name] = module
+
+    # let the benchmark import the modules next to it
+    sys.path.insert(0, os.path.dirname(path))
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(os.path.dirname(path))
+    return module
+
+
+def discover(root, pattern="bench_*.py"):
+    """Find the benchmarks in the files under root matching pattern.
+    Returns {name: (function, params, options)}, name is "module:function".
+    """
+    benchmarks = {}
+
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(
+            subdirectory
+            for subdirectory in subdirectories
+            if not subdirectory.startswith((".", "__"))
+        )
+        for filename in sorted(fnmatch.filter(files, pattern)):
+            module = load_module(os.path.join(directory, filename), root)
+            for attribute, function in vars(module).items():
+                marker = getattr(function, BENCHMARK_ATTRIBUTE, None)
+                # skip benchmarks imported from another module, they are found there
+                if marker is None or function.__module__ != module.__name__:
+                    continue
+                benchmarks[f"{module.__name__}:{attribute}"] = (function, *marker)
+
+    return benchmarks
+
+
+def resolve_call(call):
+    """The function a SuiteCall refers to, with its arguments bound.
+    Its file is imported the first time, later calls (the setup of the same
+    benchmark, ...) share that module.
+    """
+    module = sys.modules.get(module_name(call.path, call.root))
+    if module is None:
+        module = load_module(call.path, call.root)
+    return partial(getattr(module, call.name), *call.args, **call.kwargs)
+
+
+def suite_reference(value, root):
+    """A SuiteCall for a function defined at the top of a benchmark module,
+    anything else (strings, None, ...) is returned as it is.
+    """
+    module = sys.modules.get(getattr(value, "__module__", None))
+    name = getattr(value, "__name__", None)
+    if module is None or name is None or vars(module).get(name) is not value:
+        return value
+    return SuiteCall(module.__file__, root, name, (), {})
+
+
+def run_suite(
+    root, pattern="bench_*.py", isolated=False, processes=None, pin=False, **defaults
+):
+    """Discover the benchmarks under root and time every parameter combination.
+    defaults are timeit arguments for benchmarks that don't set their own.
+    isolated=True runs every combination in a fresh worker process (run_isolated),
+    which imports the benchmark file again, processes and pin go to run_isolated.
+    Returns {name: Timing}, name is "module:function[params]".
+    """
+    if not isolated:
+        results = {}
+        for name, (function, params, options) in discover(root, pattern).items():
+            for label, args, kwargs in expand_params(params):
+                results[name + label] = timeit(
+                    partial(function, *args, **kwargs), **dict(defaults, **options)
+                )
+        return results
+
+    # functions don't travel to the workers, references to them do
+    benchmarks = {}
+    for name, (function, params, options) in discover(root, pattern).items():
+        path = sys.modules[function.__module__].__file__
+        attribute = name.rpartition(":")[2]
+        options = {
+            key: suite_reference(value, root)
+            for key, value in dict(defaults, **options).items()
+        }
+        for label, args, kwargs in expand_params(params):
+            call = SuiteCall(path, root, attribute, args, kwargs)
+            benchmarks[name + label] = dict(options, code=call)
+
+    return run_isolated(benchmarks, processes, pin)
+
+
+def save_baseline(path, timings):
+    """Add (or replace) named Timing results in a json baseline file."""
+    try:
+        with open(path, "r") as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        baseline = {}
+
+    for name, timing in timings.items():
+        entry = timing._asdict()
+        if timing.memory is not None:
+            entry["memory"] = timing.memory._asdict()
+        baseline[name] = entry
+
+    with open(path, "w") as file:
+        json.dump(baseline, file, indent=2)
+
+
+def load_baseline(path):
+    with open(path, "r") as file:
+        baseline = json.load(file)
+
+    timings = {}
+    for name, entry in baseline.items():
+        entry["samples"] = tuple(entry["samples"])
+        if entry.get("memory") is not None:
+            entry["memory"] = Memory(**entry["memory"])
+        timings[name] = Timing(**entry)
+    return timings
+
+
+def t_critical(degrees_of_freedom):
+    # take the row of the next smaller degrees of freedom, to stay on the safe side
+    critical = T_CRITICAL_95[0][1]
+    for table_df, value in T_CRITICAL_95:
+        if degrees_of_freedom < table_df:
+            break
+        critical = value
+    return critical
+
+
+def is_significant(first, second):
+    """Welch's t-test at 95% on the per-round samples of two timings."""
+    n1, n2 = len(first), len(second)
+    if n1 < 2 or n2 < 2:
+        return False
+
+    variance1 = statistics.variance(first) / n1
+    variance2 = statistics.variance(second) / n2
+    difference = statistics.mean(first) - statistics.mean(second)
+
+    if variance1 + variance2 == 0:
+        return difference != 0
+
+    t = difference / math.sqrt(variance1 + variance2)
+    degrees_of_freedom = (variance1 + variance2) ** 2 / (
+        variance1**2 / (n1 - 1) + variance2**2 / (n2 - 1)
+    )
+    return abs(t) > t_critical(degrees_of_freedom)
+
+
+def compare_timings(name, baseline, current, threshold=0.05):
+    """Flag a change only if the medians moved by more than `threshold`
+    and the difference is statistically significant.
+    """
+    change = current.median / baseline.median - 1
+    significant = is_significant(baseline.samples, current.samples)
+
+    verdict = "same"
+    if significant and change > threshold:
+        verdict = "slower"
+    elif significant and change < -threshold:
+        verdict = "faster"
+
+    return Comparison(name, baseline, current, change, significant, verdict)
+
+
+def format_comparison(comparison):
+    return (
+        f"{comparison.name}: {comparison.verdict} "
+        f"({comparison.change:+.1%}, median {format_time(comparison.baseline.median)} "
+        f"-> {format_time(comparison.current.median)}"
+        f"{', significant' if comparison.significant else ', not significant'})"
+    )
+
+
+def format_time(seconds):
+    for unit, scale in TIME_UNITS:
+        if abs(seconds) >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / TIME_UNITS[-1][1]:.3g} {TIME_UNITS[-1][0]}"
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.4g} {unit}"
+        size /= 1024
+    return f"{size:.4g} GiB"
+
+
+def format_memory(memory):
+    lines = [
+        f"memory ({memory.loops} traced loops): peak {format_size(memory.peak)}, "
+        f"{memory.blocks_per_loop:.3g} blocks / {format_size(memory.bytes_per_loop)} "
+        f"left allocated per loop",
+        f"gc collections per generation: {memory.gc_collections}",
+    ]
+    for site, size, blocks in memory.top_sites:
+        lines.append(f"  {site}: {format_size(size)} in {blocks} blocks")
+    return "\n".join(lines)
+
+
+def format_profile(result):
+    lines = []
+    for title, rows in (
+        ("cumulative", result.by_cumulative),
+        ("self", result.by_self),
+    ):
+        lines.append(f"profile ({result.loops} loops), by {title} time per loop:")
+        lines.append(f"  {'calls':>10} {'cumulative':>12} {'self':>12}  function")
+        for function, calls, self_time, cumulative in rows:
+            lines.append(
+                f"  {calls / result.loops:>10.4g} "
+                f"{format_time(cumulative / result.loops):>12} "
+                f"{format_time(self_time / result.loops):>12}  {function}"
+            )
+
+    if result.lines is not None:
+        lines.append(f"lines ({result.loops} loops), time per loop:")
+        lines.append(f"  {'hits':>10} {'time':>12}  line")
+        for location, hits, seconds, source in result.lines:
+            lines.append(
+                f"  {hits / result.loops:>10.4g} "
+                f"{format_time(seconds / result.loops):>12}  {location}  {source}"
+            )
+    return "\n".join(lines)
+
+
+def format_suite(results):
+    """A table of the results, fastest first, each relative to the fastest."""
+    if not results:
+        return "no benchmarks found"
+
+    ranked = sorted(results.items(), key=lambda item: item[1].median)
+    fastest = ranked[0][1].median
+    width = max(len("benchmark"), *(len(name) for name in results))
+
+    lines = [
+        f"{'benchmark':<{width}} {'loops':>8} {'median':>10} {'min':>10} "
+        f"{'p95':>10} {'stdev':>10} {'relative':>9}"
+    ]
+    for name, timing in ranked:
+        relative = timing.median / fastest if fastest else float("inf")
+        lines.append(
+            f"{name:<{width}} {timing.repeats:>8} {format_time(timing.median):>10} "
+            f"{format_time(timing.min):>10} {format_time(timing.p95):>10} "
+            f"{format_time(timing.stdev):>10} {relative:>8.2f}x"
+        )
+    return "\n".join(lines)
+
+
+def format_speedup(speedup):
+    if speedup.low <= 1 <= speedup.high:
+        verdict = "no clear difference"
+    elif speedup.speedup >= 1:
+        verdict = "faster"
+    else:
+        verdict = "slower"
+    return (
+        f"{speedup.name}: {speedup.speedup:.3g}x the speed of {speedup.baseline} "
+        f"({speedup.confidence:.0%} CI {speedup.low:.3g}x - {speedup.high:.3g}x), "
+        f"{verdict}"
+    )
+
+
+def format_async(result):
+    latency = result.latency
+    return (
+        f"{format_timing(result.timing)}\n"
+        f"{result.concurrency} in flight: {result.throughput:.4g} awaits/s\n"
+        f"latency per await ({latency.count} awaits): min {format_time(latency.min)}, "
+        f"mean {format_time(latency.mean)}, p50 {format_time(latency.p50)}, "
+        f"p90 {format_time(latency.p90)}, p99 {format_time(latency.p99)}, "
+        f"max {format_time(latency.max)}"
+    )
+
+
+def format_timing(timing):
+    text = (
+        f"{timing.repeats} loops x {timing.rounds} rounds, "
+        f"{timing.elapsed:.3f} s in total\n"
+        f"per loop: min {format_time(timing.min)}, "
+        f"median {format_time(timing.median)}, "
+        f"mean {format_time(timing.mean)} +- {format_time(timing.stdev)}, "
+        f"p5 {format_time(timing.p5)}, p95 {format_time(timing.p95)}"
+    )
+    if timing.memory is not None:
+        text += "\n" + format_memory(timing.memory)
+    return text
+
+
+def main(argv=None):
     # get code, repeats from arguments
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("code", type=str, help="The Python code snippet to time.")
+    parser.add_argument(
+        "code",
+        type=str,
+        nargs="*",
+        help="The Python code snippet to time. Give several to compare them, "
+        "their rounds are interleaved and the first one is the baseline",
+    )
+    parser.add_argument(
+        "--suite",
+        type=str,
+        metavar="DIR",
+        help="Run the @timing.benchmark functions of the bench_*.py files under DIR",
+    )
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        default="bench_*.py",
+        help="File name pattern of benchmark files for --suite",
+    )
     parser.add_argument(
         "-r",
         "--repeats",
         type=int,
+        default=None,
+        help="Number of times to repeat the test per round (calibrated when left out)",
+    )
+    parser.add_argument(
+        "-s", "--setup", type=str, help="Code run before every round, not timed"
+    )
+    parser.add_argument(
+        "--teardown", type=str, help="Code run after every round, not timed"
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        help="Number of independently timed rounds (5, or 10 comparing snippets)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed for the round order and bootstrap when comparing snippets",
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Untimed runs before the first round"
+    )
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=0.2,
+        help="Seconds a round should last when calibrating the repeats",
+    )
+    parser.add_argument(
+        "--async",
+        dest="async_",
+        action="store_true",
+        help="Time the snippet as the body of a coroutine function (it can await)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="With --async, how many awaits of the snippet are in flight at once",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="Also report allocations (tracemalloc) and gc collections",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
         default=10,
-        help="Number of times to repeat the test",
+        help="Allocation sites shown with --memory, functions and lines with --profile",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Also show the hottest functions (cProfile)",
+    )
+    parser.add_argument(
+        "--lines",
+        action="store_true",
+        help="With --profile, also show the time spent on each source line",
+    )
+    parser.add_argument(
+        "--isolated",
+        action="store_true",
+        help="Run the benchmark (with --suite, each one) in a fresh worker process",
+    )
+    parser.add_argument(
+        "--pin", action="store_true", help="Pin isolated workers to their own cpu"
+    )
+    parser.add_argument(
+        "--name",
+        type=str,
+        help="Name of the benchmark in baseline files (the code by default)",
+    )
+    parser.add_argument(
+        "--save", type=str, help="Save the result into this baseline file"
+    )
+    parser.add_argument(
+        "--compare", type=str, help="Compare the result with this baseline file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.05,
+        help="Relative change of the median that counts as a regression (0.05 = 5%%)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.rounds is None:
+        args.rounds = 10 if len(args.code) > 1 else 5
+
+    if args.suite is not None:
+        if args.code or args.profile:
+            parser.error("--suite can't be combined with a snippet, --profile")
+        results = run_suite(
+            args.suite,
+            args.pattern,
+            isolated=args.isolated,
+            pin=args.pin,
+            repeats=args.repeats,
+            rounds=args.rounds,
+            warmup=args.warmup,
+            target=args.target,
+            memory=args.memory,
+            top=args.top,
+        )
+        print(format_suite(results))
+        return check_results(results, args)
+
+    if not args.code:
+        parser.error("give a snippet to time or --suite DIR")
+
+    if len(args.code) > 1:
+        if args.isolated or args.profile or args.memory or args.async_:
+            parser.error(
+                "can't compare snippets with --isolated, --profile, --memory, --async"
+            )
+        print(f"timing {len(args.code)} snippets, rounds interleaved...")
+        results, speedups = timeit_interleaved(
+            args.code,
+            repeats=args.repeats,
+            rounds=args.rounds,
+            warmup=args.warmup,
+            target=args.target,
+            setup=args.setup,
+            teardown=args.teardown,
+            seed=args.seed,
+        )
+        for name, result in results.items():
+            print(f"{name}:\n{format_timing(result)}")
+        for speedup in speedups:
+            print(format_speedup(speedup))
+        return check_results(results, args)
+
+    (args.code,) = args.code
+
+    if args.async_:
+        if args.isolated or args.profile or args.memory:
+            parser.error(
+                "--async can't be combined with --isolated, --profile, --memory"
+            )
+        print(f"timing async: {args.code}...")
+        result = timeit_async(
+            args.code,
+            repeats=args.repeats,
+            rounds=args.rounds,
+            warmup=args.warmup,
+            target=args.target,
+            concurrency=args.concurrency,
+            setup=args.setup,
+            teardown=args.teardown,
+        )
+        print(format_async(result))
+        return check_results({args.name or args.code: result.timing}, args)
+
+    options = dict(
+        code=str(args.code),
+        repeats=args.repeats,
+        rounds=args.rounds,
+        warmup=args.warmup,
+        target=args.target,
+        setup=args.setup,
+        teardown=args.teardown,
+        memory=args.memory,
+        top=args.top,
     )
-    args = parser.parse_args()
 
     print(f"timing: {args.code}...")
-    print(timeit(code=str(args.code), repeats=args.repeats))
+    if args.isolated:
+        result = run_isolated({args.code: options}, pin=args.pin)[args.code]
+    else:
+        result = timeit(**options)
+    print(format_timing(result))
+
+    if args.profile:
+        print(
+            format_profile(
+                profile(
+                    str(args.code),
+                    repeats=args.repeats,
+                    warmup=args.warmup,
+                    target=args.target,
+                    setup=args.setup,
+                    teardown=args.teardown,
+                    top=args.top,
+                    lines=args.lines,
+                )
+            )
+        )
+
+    return check_results({args.name or args.code: result}, args)
+
+
+def check_results(results, args):
+    """Compare results with and/or save them to the baseline files given on the
+    command line. Returns the exit status, 1 if anything got slower.
+    """
+    status = 0
+
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        for name, result in results.items():
+            if name not in baseline:
+                print(f"{name!r} is not in {args.compare}, nothing to compare")
+                continue
+            comparison = compare_timings(name, baseline[name], result, args.threshold)
+            print(format_comparison(comparison))
+            if comparison.verdict == "slower":
+                status = 1
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())